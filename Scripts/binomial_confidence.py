@@ -1,7 +1,12 @@
+import json
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.stats import binom
-from matplotlib.patches import Rectangle
+from os.path import exists
+from scipy.stats import beta, binom, norm
+
+# Version of the sample size calculations. Increase whenever a change can alter their output, so that stored results (e.g. the web app cache) are invalidated
+ALGORITHM_VERSION = 1
+
+# Plotting functions import matplotlib when called, so that the sample size calculations can be imported (e.g. by web workers) without the plotting stack
 
 def get_n_samples_single_threshold(threshold, confidence = 0.9, accuracy = 0.02, tolerance = 0.001, n_high = 10000, n_low = 2, make_plot = False, fig_path = None):
     
@@ -17,7 +22,7 @@ def get_n_samples_single_threshold(threshold, confidence = 0.9, accuracy = 0.02,
     n_low (int, default 1): Minimum possible number of samples for initializing binary search
     
     '''
-    output = {'message': None, 'n_high': None, 'fig_path': None}
+    output = {'message': None, 'n_high': None, 'p_high': None, 'fig_path': None}
     p_high = 1 - binom.cdf(int(threshold*n_high), n_high, threshold + accuracy) # Probability of classifying score threshold + accuracy as red, with n_high samples
     p_low = 1 - binom.cdf(int(threshold*n_low), n_low, threshold + accuracy) # Probability of classigying score threshold + accuracy as green, with n_low samples
 
@@ -42,6 +47,7 @@ def get_n_samples_single_threshold(threshold, confidence = 0.9, accuracy = 0.02,
         p_low = 1 - binom.cdf(int(threshold*n_low), n_low, threshold + accuracy)
      
     output['n_high'] = n_high
+    output['p_high'] = p_high
     
     if make_plot:
         schematic_single_threshold(threshold, accuracy, confidence, n_high, p_high, fig_path)
@@ -108,6 +114,476 @@ def get_n_samples_two_thresholds(t_green = 0.3, t_red = 0.7, accuracy = 0.02, co
     return output
     
     
+# Largest number of (parameter combination x n) probabilities evaluated at once by the grid solvers
+MAX_GRID_ELEMENTS = 2**22
+
+# Number of counts by which int(threshold*n) may fall below threshold*n in the normal approximation of get_n_samples_exact_single_threshold()
+SAWTOOTH_SLACK = 2
+
+def classification_probability(threshold, accuracy, n_samples, band = 'red'):
+    
+    '''
+    Return the probability of correctly classifying a worker whose discrepancy score is accuracy away from threshold, with n_samples samples. 
+    All inputs are broadcast against each other.
+    
+    Inputs:
+    threshold (float or array, between 0 and 1): Threshold for classifying workers
+    accuracy (float or array, between 0 and 1): Distance from threshold at which confidence guarantee applies
+    n_samples (int or array): Number of samples
+    band (string, default 'red'): 'red' for the probability of classifying score threshold + accuracy as red (more than int(threshold*n_samples) discrepancies), 
+                                  'green' for the probability of classifying score threshold - accuracy as green (at most int(threshold*n_samples) discrepancies)
+    
+    '''
+    
+    threshold = np.asarray(threshold, dtype = float)
+    n_samples = np.asarray(n_samples)
+    k = np.floor(threshold*n_samples)
+    
+    if band == 'red':
+        return binom.sf(k, n_samples, threshold + accuracy)
+    elif band == 'green':
+        return binom.cdf(k, n_samples, threshold - accuracy)
+    else:
+        raise ValueError("band must be 'red' or 'green'.")
+
+def red_classification_probability(threshold, accuracy, n_samples):
+    
+    '''
+    Return classification_probability(threshold, accuracy, n_samples, 'red'), computed as 1 - exp(binom.logcdf(...)) to stay precise close to 1.
+    '''
+    
+    return -np.expm1(binom.logcdf(np.floor(threshold*np.asarray(n_samples)), n_samples, threshold + accuracy))
+
+def classification_curves(t_red = 0.7, t_green = None, accuracy = 0.02, n_high = 1000, n_low = 1, max_points = None):
+    
+    '''
+    Return the probabilities of correctly classifying workers in 'red band' and 'green band' for every number of samples from n_low to n_high, 
+    in one vectorized evaluation.
+    
+    Inputs:
+    t_red (float between 0 and 1, default 0.7): Threshold for classifying workers in 'red band'. Discrepancy scores > t_red will be classified as red band.
+    t_green (float between 0 and 1, default None): Threshold for classifying workers in 'green band'. If None, only the red band curve is returned.
+    accuracy (float between 0 and 1, default 0.02): Distance from threshold at which confidence guarantee applies. 
+    n_high (int, default 1000): Largest number of samples
+    n_low (int, default 1): Smallest number of samples
+    max_points (int, default None): if given, evaluate at most max_points evenly spaced numbers of samples (always including n_low and n_high)
+    
+    Output:
+    output (dict):
+        'n_samples' (array, int): numbers of samples
+        'p_red' (array, float): probability of classifying score t_red + accuracy as red band with each number of samples
+        'p_green' (array, float): probability of classifying score t_green - accuracy as green band with each number of samples, or None if t_green is None
+    
+    '''
+    
+    if max_points is None or max_points >= n_high - n_low + 1:
+        n_samples = np.arange(n_low, n_high + 1)
+    else:
+        n_samples = np.unique(np.round(np.linspace(n_low, n_high, max(max_points, 2))).astype(int))
+    
+    output = {'n_samples': n_samples, 'p_red': classification_probability(t_red, accuracy, n_samples, 'red'), 'p_green': None}
+    if t_green is not None:
+        output['p_green'] = classification_probability(t_green, accuracy, n_samples, 'green')
+    
+    return output
+
+def get_n_samples_grid_single_threshold(threshold, confidence = 0.9, accuracy = 0.02, n_high = 10000, n_low = 2, search = 'bisection'):
+    
+    '''
+    Return the least number of samples between n_low and n_high required to classify workers in 'red band' with the desired confidence, 
+    for every combination of threshold, confidence and accuracy at once. Inputs are broadcast against each other, e.g. 
+    get_n_samples_grid_single_threshold(thresholds[:, None, None], confidences[None, :, None], accuracies[None, None, :]) solves a 3-D grid.
+    Classification probabilities of all parameter combinations are evaluated together, with one vectorized binom.sf call per search step.
+    
+    Inputs:
+    threshold (float or array, between 0 and 1): Threshold for classifying workers in 'red band'. Discrepancy scores > threshold will be classified as red band.
+    confidence (float or array, between 0 and 1, default 0.9): Desired probability of correctly classifying workers as red band.
+    accuracy (float or array, between 0 and 1, default 0.02): Distance from threshold at which confidence guarantee applies.
+    n_high (int, default 10,000): Maximum number of samples searched
+    n_low (int, default 2): Minimum number of samples searched
+    search (string, default 'bisection'): 'bisection' or 'scan', see solve_n_samples_grid()
+    
+    Output:
+    n_samples (array, float): number of samples with classification probability > confidence, np.nan where n_high samples are not enough
+    
+    '''
+    
+    threshold, confidence, accuracy = np.broadcast_arrays(np.asarray(threshold, dtype = float), np.asarray(confidence, dtype = float), 
+                                                          np.asarray(accuracy, dtype = float))
+    shape = threshold.shape
+    # One row per parameter combination, to broadcast against a row of candidate n
+    threshold, confidence, accuracy = [np.reshape(x, [-1, 1]) for x in [threshold, confidence, accuracy]]
+    
+    def is_enough(n, index):
+        return classification_probability(threshold[index], accuracy[index], n, 'red') > confidence[index]
+    
+    return solve_n_samples_grid(is_enough, shape, n_high, n_low, search = search)
+
+def get_n_samples_grid_two_thresholds(t_green = 0.3, t_red = 0.7, accuracy = 0.02, confidence = 0.9, n_high = 10000, n_low = 2, search = 'bisection'):
+    
+    '''
+    Return the least number of samples between n_low and n_high required to classify workers in both 'green band' and 'red band' with the desired confidence, 
+    for every combination of t_green, t_red, accuracy and confidence at once. Inputs are broadcast against each other, see get_n_samples_grid_single_threshold().
+    
+    Inputs:
+    t_green (float or array between 0 and 1, default 0.3): Threshold for classifying workers in 'green band'. Discrepancy scores < t_green will be classified as green band.
+    t_red (float or array between 0 and 1, default 0.7): Threshold for classifying workers in 'red band'. Discrepancy scores > t_red will be classified as red band.
+    accuracy (float or array between 0 and 1, default 0.02): Distance from threshold at which confidence guarantee applies. 
+    confidence (float or array between 0 and 1, default 0.9): Desired probability of correctly classifying workers as green band or red band.
+    n_high (int, default 10,000): Maximum number of samples searched
+    n_low (int, default 2): Minimum number of samples searched
+    search (string, default 'bisection'): 'bisection' or 'scan', see solve_n_samples_grid()
+    
+    Output:
+    n_samples (array, float): number of samples with both classification probabilities > confidence, np.nan where n_high samples are not enough
+    
+    '''
+    
+    t_green, t_red, accuracy, confidence = np.broadcast_arrays(np.asarray(t_green, dtype = float), np.asarray(t_red, dtype = float), 
+                                                               np.asarray(accuracy, dtype = float), np.asarray(confidence, dtype = float))
+    shape = t_green.shape
+    # One row per parameter combination, to broadcast against a row of candidate n
+    t_green, t_red, accuracy, confidence = [np.reshape(x, [-1, 1]) for x in [t_green, t_red, accuracy, confidence]]
+    
+    def is_enough(n, index):
+        p_green = classification_probability(t_green[index], accuracy[index], n, 'green')
+        p_red = classification_probability(t_red[index], accuracy[index], n, 'red')
+        return np.logical_and(p_green > confidence[index], p_red > confidence[index])
+    
+    return solve_n_samples_grid(is_enough, shape, n_high, n_low, search = search)
+
+def get_n_samples_exact_single_threshold(threshold, confidence = 0.9, accuracy = 0.02, n_high = 10000000, n_low = 1):
+    
+    '''
+    Return the least number of samples required to classify workers in 'red band' with the desired confidence, without assuming that classification 
+    probability increases with n (because of int(threshold*n), it is a sawtooth in n). Also returns the least number of samples from which every larger 
+    number of samples is also enough.
+    
+    Every n beyond the last peak of the sawtooth that is not enough is enough (see get_sawtooth_bound(), which locates it with a few evaluations, 
+    and the looser Chernoff bound log(1/(1 - confidence))/KL(threshold || threshold + accuracy)), so only n below that are evaluated: a window from 
+    the normal approximation estimate, allowing for int(threshold*n) being up to SAWTOOTH_SLACK counts below threshold*n, and any small n for which 
+    the normal approximation cannot rule out success. Failure probabilities are compared in log space (binom.logcdf), which stays precise 
+    for confidence close to 1.
+    
+    Inputs:
+    threshold (float between 0 and 1): Threshold for classifying workers in 'red band'. Discrepancy scores > threshold will be classified as red band.
+    confidence (float between 0 and 1, default 0.9): Desired probability of correctly classifying workers as red band.
+    accuracy (float between 0 and 1, default 0.02): Distance from threshold at which confidence guarantee applies. 
+    n_high (int, default 10,000,000): Maximum number of samples searched. The window in which numbers of samples become enough is searched entirely if 
+                                      it starts at or below n_high, so n_min and n_stable are exact whenever they are at most n_high
+    n_low (int, default 1): Minimum number of samples searched
+    
+    Output:
+    output (dict):
+        'message' (string): None, or reason why no number of samples was found
+        'n_min' (int): least number of samples with classification probability > confidence
+        'n_stable' (int): least number of samples such that all numbers of samples >= n_stable have classification probability > confidence
+        'p_min' (float): classification probability with n_min samples
+        'n_evaluations' (int): number of n at which the binomial distribution was evaluated
+    
+    '''
+    
+    output = {'message': None, 'n_min': None, 'n_stable': None, 'p_min': None, 'n_evaluations': 0}
+    q = threshold + accuracy
+    
+    if accuracy <= 0:
+        output['message'] = 'Accuracy must be greater than 0'
+        return output
+    if confidence >= 1:
+        # Misclassification has positive probability for any number of samples
+        output['message'] = 'Confidence must be smaller than 1'
+        return output
+    if q >= 1:
+        # Every sample is a discrepancy, so the worker is always classified as red
+        output.update({'n_min': n_low, 'n_stable': n_low, 'p_min': 1.0})
+        return output
+    
+    log_failure = np.log1p(-confidence) # Classification probability > confidence <=> log(probability of misclassification) < log_failure
+    
+    # Chernoff bound: P(X <= threshold*n) <= exp(-n*KL(threshold || q)) for X ~ Binomial(n, q)
+    kl = -np.log(1 - q) if threshold == 0 else threshold*np.log(threshold/q) + (1 - threshold)*np.log((1 - threshold)/(1 - q))
+    n_chernoff = int(np.floor(-log_failure/kl)) + 1
+    n_bound = n_chernoff if threshold == 0 else min(n_chernoff, get_sawtooth_bound(threshold, q, log_failure, n_chernoff, output))
+    n_stop = n_bound # Numbers of samples from n_stop on are not evaluated
+    
+    # Normal approximation: n samples can only be enough if accuracy*n + SAWTOOTH_SLACK >= z*sqrt(n*q*(1 - q)), i.e. sqrt(n) is outside the roots below
+    z = norm.ppf(confidence)
+    discriminant = z**2*q*(1 - q) - 4*accuracy*SAWTOOTH_SLACK
+    if z <= 0 or discriminant < 0:
+        windows = [[n_low, n_stop]]
+    else:
+        roots = (z*np.sqrt(q*(1 - q)) + np.array([-1, 1])*np.sqrt(discriminant))/(2*accuracy)
+        small_stop = min(int(np.ceil(roots[0]**2)) + 1, n_stop)
+        windows = [[n_low, small_stop], [max(int(np.floor(roots[1]**2)), small_stop, n_low), n_stop]]
+    if windows[-1][0] > n_high:
+        # Numbers of samples only become enough above n_high, so the window in which they do is not searched
+        n_stop = n_high + 1
+        windows = [[start, min(stop, n_stop)] for start, stop in windows]
+    
+    def scan(start, stop):
+        # Return numbers of samples in [start, stop) and whether each is enough, evaluated in blocks of at most MAX_GRID_ELEMENTS
+        n = np.arange(start, stop)
+        enough = np.zeros(len(n), dtype = bool)
+        for block in range(0, len(n), MAX_GRID_ELEMENTS):
+            n_block = n[block:block + MAX_GRID_ELEMENTS]
+            enough[block:block + MAX_GRID_ELEMENTS] = binom.logcdf(np.floor(threshold*n_block), n_block, q) < log_failure
+        output['n_evaluations'] += len(n)
+        return n, enough
+    
+    n, enough = scan(*windows[0])
+    if len(windows) > 1:
+        # Extend the upper window downwards until it starts with a number of samples that is not enough, so that n_stable is exact
+        start = windows[1][0]
+        upper_n, upper_enough = scan(start, windows[1][1])
+        width = max(len(upper_n), 16)
+        while start > windows[0][1] and (len(upper_enough) == 0 or upper_enough[0]):
+            new_start = max(windows[0][1], start - width)
+            new_n, new_enough = scan(new_start, start)
+            upper_n, upper_enough = np.concatenate([new_n, upper_n]), np.concatenate([new_enough, upper_enough])
+            start = new_start
+            width *= 2
+        n, enough = np.concatenate([n, upper_n]), np.concatenate([enough, upper_enough])
+    
+    if n_stop == n_bound:
+        # Every n >= n_stop is enough, so n_stable follows the last evaluated n that is not enough
+        output['n_stable'] = int(n[np.flatnonzero(~enough)[-1]] + 1) if not np.all(enough) else n_low
+    if np.any(enough):
+        output['n_min'] = int(n[np.argmax(enough)])
+    elif output['n_stable'] is not None:
+        output['n_min'] = output['n_stable']
+    
+    if output['n_min'] is None:
+        output['message'] = 'Increase maximum # samples'
+    else:
+        output['p_min'] = float(red_classification_probability(threshold, accuracy, output['n_min']))
+    
+    return output
+
+def get_sawtooth_bound(threshold, q, log_failure, n_chernoff, output):
+    
+    '''
+    Return a number of samples from which every larger number of samples is enough for get_n_samples_exact_single_threshold(), close to the last 
+    number of samples that is not.
+    
+    The misclassification probability P(X <= int(threshold*n)), X ~ Binomial(n, q), decreases with n while int(threshold*n) = k stays the same, so it peaks 
+    at the first n of each k, n_k >= k/threshold. Writing the binomial CDF as a regularized incomplete beta function, which decreases with its first 
+    argument, each peak is at most envelope(k) = I_{1 - q}(k/threshold - k, k + 1), a smooth decreasing function of k. The least k with 
+    envelope(k) < exp(log_failure) is found by bisection, and every n with int(threshold*n) >= k is enough.
+    
+    Inputs:
+    threshold (float between 0 and 1, > 0), q (float, threshold + accuracy), log_failure (float, log(1 - confidence)): as in get_n_samples_exact_single_threshold()
+    n_chernoff (int): number of samples from which every larger number of samples is known to be enough
+    output (dict): output of get_n_samples_exact_single_threshold(), whose 'n_evaluations' is increased by the number of envelope evaluations
+    
+    Output:
+    n_bound (int): number of samples from which every larger number of samples is enough (at most n_chernoff + 1/threshold)
+    
+    '''
+    
+    def envelope_enough(k):
+        output['n_evaluations'] += 1
+        return beta.logcdf(1 - q, k/threshold - k, k + 1) < log_failure
+    
+    k_low = 1
+    k_high = int(np.floor(threshold*n_chernoff)) + 1
+    if envelope_enough(k_low):
+        k_high = k_low
+    elif not envelope_enough(k_high):
+        return n_chernoff
+    while k_high - k_low > 1:
+        k_mid = (k_low + k_high)//2
+        if envelope_enough(k_mid):
+            k_high = k_mid
+        else:
+            k_low = k_mid
+    
+    # First number of samples with int(threshold*n) >= k_high, allowing for rounding of threshold*n
+    n_bound = int(np.ceil(k_high/threshold))
+    while n_bound > 1 and np.floor(threshold*(n_bound - 1)) >= k_high:
+        n_bound -= 1
+    while np.floor(threshold*n_bound) < k_high:
+        n_bound += 1
+    
+    return n_bound
+
+# Default grid of precomputed sample size tables: (first value, last value, step) of each parameter
+TABLE_AXES = {'threshold': (0.01, 0.99, 0.01), 'confidence': (0.5, 0.99, 0.01), 'accuracy': (0.005, 0.2, 0.005)}
+
+# Fields of each entry of a sample size table, see get_n_samples_exact_single_threshold()
+TABLE_DTYPE = np.dtype([('n_min', np.int32), ('n_stable', np.int32), ('p_stable', np.float32)])
+
+# Sample size tables opened by load_sample_size_table(), by path
+loaded_tables = {}
+
+def table_axis(first, last, step):
+    
+    '''
+    Return the values of one axis of a sample size table.
+    '''
+    
+    return np.round(first + step*np.arange(int(round((last - first)/step)) + 1), 10)
+
+def build_sample_size_table(path, axes = TABLE_AXES, n_high = 10000000):
+    
+    '''
+    Precompute get_n_samples_exact_single_threshold() over a dense grid of threshold, confidence and accuracy, and save it for load_sample_size_table(). 
+    Writes <path>.npy (structured array of TABLE_DTYPE, indexed [threshold, confidence, accuracy], n_min = n_stable = -1 where n_high is not enough) 
+    and <path>.json (axes and ALGORITHM_VERSION). 
+    
+    Inputs:
+    path (string): path of table files, without extension
+    axes (dict, default TABLE_AXES): (first value, last value, step) of 'threshold', 'confidence' and 'accuracy'
+    n_high (int, default 10,000,000): Maximum number of samples searched
+    
+    '''
+    
+    values = {name: table_axis(*axes[name]) for name in ['threshold', 'confidence', 'accuracy']}
+    table = np.zeros([len(values['threshold']), len(values['confidence']), len(values['accuracy'])], dtype = TABLE_DTYPE)
+    
+    for i, threshold in enumerate(values['threshold']):
+        for j, confidence in enumerate(values['confidence']):
+            for k, accuracy in enumerate(values['accuracy']):
+                output = get_n_samples_exact_single_threshold(threshold, confidence = confidence, accuracy = accuracy, n_high = n_high)
+                if output['n_stable'] is None:
+                    table[i, j, k] = (-1, -1, np.nan)
+                else:
+                    table[i, j, k] = (output['n_min'], output['n_stable'], red_classification_probability(threshold, accuracy, output['n_stable']))
+    
+    np.save('{0}.npy'.format(path), table)
+    with open('{0}.json'.format(path), 'w') as f:
+        json.dump({'algorithm_version': ALGORITHM_VERSION, 'axes': {name: list(axes[name]) for name in values}}, f)
+
+def load_sample_size_table(path):
+    
+    '''
+    Open a table written by build_sample_size_table() as a read-only memory map. Returns None if the table does not exist or was computed by another ALGORITHM_VERSION.
+    Tables are opened once per process and reused. Misses are not remembered, so a table built while the process is running is picked up by the next call.
+    '''
+    
+    if path not in loaded_tables:
+        # build_sample_size_table() writes the .json after the .npy, so both exist once the table is complete
+        if not (exists('{0}.npy'.format(path)) and exists('{0}.json'.format(path))):
+            return None
+        with open('{0}.json'.format(path)) as f:
+            metadata = json.load(f)
+        if metadata['algorithm_version'] != ALGORITHM_VERSION:
+            return None
+        loaded_tables[path] = {'table': np.load('{0}.npy'.format(path), mmap_mode = 'r'), 'axes': metadata['axes']}
+    
+    return loaded_tables[path]
+
+def lookup_n_samples_single_threshold(threshold, confidence = 0.9, accuracy = 0.02, table_path = None, exact = False, n_high = 10000000):
+    
+    '''
+    Return the numbers of samples of get_n_samples_exact_single_threshold(), from a precomputed table (see build_sample_size_table()) if the parameters 
+    lie on its grid, and by exact computation otherwise.
+    
+    Inputs:
+    threshold (float between 0 and 1): Threshold for classifying workers in 'red band'. Discrepancy scores > threshold will be classified as red band.
+    confidence (float between 0 and 1, default 0.9): Desired probability of correctly classifying workers as red band.
+    accuracy (float between 0 and 1, default 0.02): Distance from threshold at which confidence guarantee applies. 
+    table_path (string, default None): path of table files, without extension. If None, or the table does not exist, results are computed exactly
+    exact (bool, default False): if True, skip the table and compute exactly
+    n_high (int, default 10,000,000): Maximum number of samples searched by exact computation
+    
+    Output:
+    output (dict): 'message', 'n_min', 'n_stable' and 'p_stable' as in get_n_samples_exact_single_threshold() (with p_min replaced by 
+                   p_stable, the classification probability with n_stable samples), and 'source', 'table' or 'exact'
+    
+    '''
+    
+    if not exact and table_path is not None:
+        output = lookup_sample_size_table(table_path, threshold, confidence, accuracy)
+        if output is not None:
+            return output
+    
+    output = get_n_samples_exact_single_threshold(threshold, confidence = confidence, accuracy = accuracy, n_high = n_high)
+    p_stable = None
+    if output['n_stable'] is not None:
+        p_stable = float(red_classification_probability(threshold, accuracy, output['n_stable']))
+    
+    return {'message': output['message'], 'n_min': output['n_min'], 'n_stable': output['n_stable'], 'p_stable': p_stable, 'source': 'exact'}
+
+def lookup_sample_size_table(table_path, threshold, confidence, accuracy):
+    
+    '''
+    Return the entry of a precomputed table (see lookup_n_samples_single_threshold() for the output), or None if the table does not exist 
+    or the parameters are not on its grid. Uses only index arithmetic on the memory-mapped table, no scipy calls.
+    '''
+    
+    loaded = load_sample_size_table(table_path)
+    if loaded is None:
+        return None
+    
+    index = []
+    for name, value in [['threshold', threshold], ['confidence', confidence], ['accuracy', accuracy]]:
+        first, last, step = loaded['axes'][name]
+        i = int(round((value - first)/step))
+        if i < 0 or i >= loaded['table'].shape[len(index)] or abs(first + i*step - value) > 1e-9:
+            return None
+        index.append(i)
+    
+    entry = loaded['table'][tuple(index)]
+    if entry['n_stable'] < 0:
+        return {'message': 'Increase maximum # samples', 'n_min': None, 'n_stable': None, 'p_stable': None, 'source': 'table'}
+    
+    return {'message': None, 'n_min': int(entry['n_min']), 'n_stable': int(entry['n_stable']), 'p_stable': float(entry['p_stable']), 'source': 'table'}
+
+def solve_n_samples_grid(is_enough, shape, n_high, n_low, search = 'bisection'):
+    
+    '''
+    Solve for the number of samples of every parameter combination of a grid at once.
+    
+    Inputs:
+    is_enough (function): is_enough(n, index) returns a boolean array, True where n samples are enough, for flat indices of parameter combinations index 
+                          and numbers of samples n (either a column array with one n per combination, or a row array of candidate n for all of them)
+    shape (tuple): shape of the parameter grid
+    n_high (int): Maximum number of samples searched
+    n_low (int): Minimum number of samples searched
+    search (string, default 'bisection'): One of the following options:
+        1. 'bisection': binary search run in lockstep for all combinations, one vectorized evaluation per step. Like get_n_samples_single_threshold(), 
+                        returns an n that is enough while n - 1 is not, which need not be the least such n because classification probability is not monotone in n
+        2. 'scan': evaluate blocks of candidate n for all unsolved combinations together and return the least n that is enough
+    
+    '''
+    
+    n_samples = np.full(int(np.prod(shape)), np.nan)
+    
+    if search == 'bisection':
+        index = np.arange(len(n_samples))
+        n_high_grid = np.full([len(n_samples), 1], n_high)
+        n_low_grid = np.full([len(n_samples), 1], n_low)
+        high_enough = is_enough(n_high_grid, index)[:, 0]
+        low_enough = is_enough(n_low_grid, index)[:, 0]
+        n_samples[low_enough] = n_low
+        
+        # Bisect combinations that are enough at n_high but not at n_low
+        index = index[np.logical_and(high_enough, ~low_enough)]
+        n_high_grid = n_high_grid[index]
+        n_low_grid = n_low_grid[index]
+        while np.any(n_high_grid - n_low_grid > 1):
+            n_mid = (n_high_grid + n_low_grid)//2
+            mid_enough = is_enough(n_mid, index)
+            n_high_grid = np.where(mid_enough, n_mid, n_high_grid)
+            n_low_grid = np.where(mid_enough, n_low_grid, n_mid)
+        n_samples[index] = n_high_grid[:, 0]
+        
+    elif search == 'scan':
+        unsolved = np.arange(len(n_samples))
+        start = n_low
+        while start <= n_high and len(unsolved) > 0:
+            # Block of candidate n sized so that unsolved combinations x candidate n holds at most MAX_GRID_ELEMENTS
+            n = np.arange(start, min(start + max(MAX_GRID_ELEMENTS // len(unsolved), 1), n_high + 1))[None, :]
+            enough = is_enough(n, unsolved)
+            solved = np.any(enough, axis = 1)
+            n_samples[unsolved[solved]] = n[0, np.argmax(enough[solved], axis = 1)]
+            unsolved = unsolved[~solved]
+            start = n[0, -1] + 1
+    else:
+        raise ValueError("search must be 'bisection' or 'scan'.")
+    
+    return np.reshape(n_samples, shape)
+
 def schematic_two_thresholds(t_green, t_red, accuracy, confidence, n_samples, p_green, p_red, fig_path):
     
     '''
@@ -123,6 +599,9 @@ def schematic_two_thresholds(t_green, t_red, accuracy, confidence, n_samples, p_
     p_red (float, between 0 and 1): Actual probability of correctly classifying workers as red band with n_samples samples.
     
     '''
+    
+    import matplotlib.pyplot as plt
+    from matplotlib.patches import Rectangle
 
     fig, ax = plt.subplots(figsize = [20, 4])
 
@@ -184,8 +663,48 @@ def schematic_single_threshold(t_red, accuracy, confidence, n_samples, p_red, sa
     p_red (float, between 0 and 1): Actual probability of correctly classifying workers as red band with n_samples samples.
     
     '''
+    
+    import matplotlib.pyplot as plt
 
     fig, ax = plt.subplots(figsize = [20, 4])
+    draw_schematic_single_threshold(ax, t_red, accuracy, confidence, n_samples, p_red)
+    plt.savefig('{0}.png'.format(save_path))
+
+def render_schematic_single_threshold(t_red, accuracy, confidence, n_samples, p_red, image_format = 'png'):
+    
+    '''
+    Render the plot of schematic_single_threshold() into an in-memory image, using matplotlib's object-oriented Agg API instead of global pyplot state, 
+    so that it is safe to call from concurrent web requests and leaves no open figures behind.
+    
+    Inputs: as schematic_single_threshold(), except
+    image_format (string, default 'png'): 'png' or 'svg'
+    
+    Output:
+    image (bytes): encoded image
+    
+    '''
+    
+    from io import BytesIO
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    
+    fig = Figure(figsize = [20, 4])
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    draw_schematic_single_threshold(ax, t_red, accuracy, confidence, n_samples, p_red)
+    
+    buffer = BytesIO()
+    fig.savefig(buffer, format = image_format)
+    
+    return buffer.getvalue()
+
+def draw_schematic_single_threshold(ax, t_red, accuracy, confidence, n_samples, p_red):
+    
+    '''
+    Draw the plot of schematic_single_threshold() on the axes ax.
+    '''
+    
+    from matplotlib.patches import Rectangle
 
     width = 1
     box_bottom = 1
@@ -209,12 +728,12 @@ def schematic_single_threshold(t_red, accuracy, confidence, n_samples, p_red, sa
     rect = Rectangle([left, box_bottom], right - left, height, color = 'yellow')
     ax.add_patch(rect)
 
-    plt.plot([t_red, t_red], [box_bottom - 0.1*height, box_bottom + 1.1*height], color = 'k', linestyle = '--')
-    plt.yticks([])
-    plt.xticks(np.round([0, t_green - accuracy, t_green, t_red, t_red + accuracy, 1], 2))
-    plt.xlabel('Discrepancy score', fontsize = 15)
-    plt.text((1 + t_red)/2, 1.04, 'Red zone\nconfidence guarantee = {0}'.format(np.round(p_red, 5)), fontsize = 15, horizontalalignment = 'center')
-    plt.ylim([box_bottom, box_bottom + height])
+    ax.plot([t_red, t_red], [box_bottom - 0.1*height, box_bottom + 1.1*height], color = 'k', linestyle = '--')
+    ax.set_yticks([])
+    ax.set_xticks(np.round([0, t_red, t_red + accuracy, 1], 2))
+    ax.set_xlabel('Discrepancy score', fontsize = 15)
+    ax.text((1 + t_red)/2, 1.04, 'Red zone\nconfidence guarantee = {0}'.format(np.round(p_red, 5)), fontsize = 15, horizontalalignment = 'center')
+    ax.set_xlim([0, 1])
+    ax.set_ylim([box_bottom, box_bottom + height])
 
-    plt.title('{0} samples'.format(n_samples), fontsize = 15)
-    plt.savefig('{0}.png'.format(save_path))
\ No newline at end of file
+    ax.set_title('{0} samples'.format(n_samples), fontsize = 15)
@@ -1,6 +1,15 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+METHODS = ('percent_difference', 'absolute_difference', 'absolute_percent_difference', 'simple_difference', 'percent_non_match')
+METHOD_ERROR_MESSAGE = "The method must be one of the following: percent_difference, absolute_difference, absolute_percent_difference, simple_difference, or percent_non_match."
+
+# plot_distribution() imports matplotlib and percent_non_match_bootstrap() imports scipy when called, so that the scoring and resampling 
+# functions can be imported quickly and used without the plotting stack
+
+# Largest number of array elements (resamples x measurements) held in memory at once by the resampling engines
+MAX_BLOCK_ELEMENTS = 2**22
 
 def discrepancy_score(subordinate_variable, supervisor_variable, method):
     """Calculate the discrepancy score between two variables.
@@ -23,9 +32,39 @@ def discrepancy_score(subordinate_variable, supervisor_variable, method):
     
     """
     
-    # Flatten variable arrays and make sure they are numpy arrays
-    subordinate_variable = np.reshape(subordinate_variable, [-1])
-    supervisor_variable = np.reshape(supervisor_variable, [-1])
+    # Flatten variable arrays, make sure they are numpy arrays and check that they are the same length and type
+    subordinate_variable, supervisor_variable = check_variables(subordinate_variable, supervisor_variable)
+    
+    # Calculate the discrepancy score
+    if method == "percent_difference":
+        discrepancy_score = np.mean(np.divide((subordinate_variable - supervisor_variable), supervisor_variable)) * 100
+    elif method == "absolute_difference":
+        discrepancy_score = np.mean(abs(subordinate_variable - supervisor_variable))
+    elif method == "absolute_percent_difference":
+        discrepancy_score = np.mean(abs((subordinate_variable - supervisor_variable) / supervisor_variable * 100))
+    elif method == "simple_difference":
+        discrepancy_score = np.mean(subordinate_variable - supervisor_variable)
+    elif method == "percent_non_match":
+        discrepancy_score = np.sum(subordinate_variable != supervisor_variable) / len(subordinate_variable) * 100
+    else:
+        raise ValueError(METHOD_ERROR_MESSAGE)
+    
+    return discrepancy_score
+
+def check_variables(subordinate_variable, supervisor_variable):
+    """Flatten subordinate and supervisor variables into numpy arrays and check that they are the same length and type.
+    
+    Inputs:
+    subordinate_variable (array): values measured by subordinate
+    supervisor_variable (array): values measured by supervisor
+    
+    Outputs:
+    subordinate_variable, supervisor_variable (1-D numpy arrays)
+    
+    """
+    
+    subordinate_variable = np.reshape(np.asarray(subordinate_variable), [-1])
+    supervisor_variable = np.reshape(np.asarray(supervisor_variable), [-1])
     
     # Step 1: check that the two variables are the same length
     if len(subordinate_variable) != len(supervisor_variable):
@@ -35,25 +74,423 @@ def discrepancy_score(subordinate_variable, supervisor_variable, method):
     if type(subordinate_variable[0]) != type(supervisor_variable[0]):
         raise TypeError("The two variables must be the same type.")
     
-    # Step 3: calculate the discrepancy score
+    return subordinate_variable, supervisor_variable
+
+def discrepancy_terms(subordinate_variable, supervisor_variable, method):
+    """Calculate the per-measurement terms whose mean is the discrepancy score. 
+    Inputs are broadcast against each other, so that e.g. a 1-D subordinate variable can be scored against a 2-D block of resampled supervisor variables.
+    
+    Inputs:
+    subordinate_variable (array): values measured by subordinate
+    supervisor_variable (array): values measured by supervisor, broadcastable against subordinate_variable
+    method (string): one of METHODS, see discrepancy_score()
+    
+    Outputs:
+    terms (array, float): discrepancy of each measurement; the mean along the last axis equals discrepancy_score() of that row
+    
+    """
+    
     if method == "percent_difference":
-        discrepancy_score = np.mean(np.divide((subordinate_variable - supervisor_variable), supervisor_variable)) * 100
+        terms = np.divide((subordinate_variable - supervisor_variable), supervisor_variable) * 100
     elif method == "absolute_difference":
-        discrepancy_score = np.mean(abs(subordinate_variable - supervisor_variable))
+        terms = np.abs(subordinate_variable - supervisor_variable)
     elif method == "absolute_percent_difference":
-        discrepancy_score = np.mean(abs((subordinate_variable - supervisor_variable) / supervisor_variable * 100))
+        terms = np.abs((subordinate_variable - supervisor_variable) / supervisor_variable * 100)
     elif method == "simple_difference":
-        discrepancy_score = np.mean(subordinate_variable - supervisor_variable)
+        terms = subordinate_variable - supervisor_variable
     elif method == "percent_non_match":
-        discrepancy_score = np.sum(subordinate_variable != supervisor_variable) / len(subordinate_variable) * 100
+        terms = (subordinate_variable != supervisor_variable) * 100.0
     else:
-        raise ValueError("The method must be one of the following: percent_difference, absolute_difference, absolute_percent_difference, simple_difference, or percent_non_match.")
+        raise ValueError(METHOD_ERROR_MESSAGE)
     
-    return discrepancy_score
+    return np.asarray(terms, dtype = float)
+
+def encode_categorical(subordinate_variable, supervisor_variable):
+    """Encode subordinate and supervisor variables as integer codes of a joint vocabulary, using the smallest integer type (int8, int16, ...) that fits.
+    Two codes are equal exactly when the original values are equal, so the codes can be used in place of the values for 'percent_non_match' scoring, 
+    bootstrapping and shuffling. Missing values (NaN, which never equal anything) each get their own code beyond the vocabulary.
+    
+    Inputs:
+    subordinate_variable (array, any datatype): values measured by subordinate
+    supervisor_variable (array, any datatype): values measured by supervisor
+    
+    Outputs:
+    subordinate_codes (array, int): code of each subordinate value
+    supervisor_codes (array, int): code of each supervisor value
+    vocabulary (array): vocabulary[code] is the value encoded by code, for codes of non-missing values
+    
+    """
+    
+    subordinate_variable = np.reshape(np.asarray(subordinate_variable), [-1])
+    supervisor_variable = np.reshape(np.asarray(supervisor_variable), [-1])
+    values = np.concatenate([subordinate_variable, supervisor_variable])
+    
+    if values.dtype == object:
+        lookup = {}
+        codes = np.array([lookup.setdefault(v, len(lookup)) if v == v else -1 for v in values], dtype = np.int64)
+        vocabulary = np.empty(len(lookup), dtype = object)
+        vocabulary[:] = list(lookup.keys())
+    else:
+        missing = values != values
+        vocabulary, codes = np.unique(values[~missing], return_inverse = True)
+        codes = np.insert(np.reshape(codes, [-1]), np.flatnonzero(missing) - np.arange(np.sum(missing)), -1)
+    
+    missing = codes == -1
+    codes[missing] = len(vocabulary) + np.arange(np.sum(missing))
+    
+    dtype = next(t for t in [np.int8, np.int16, np.int32, np.int64] if len(codes) == 0 or np.max(codes) <= np.iinfo(t).max)
+    codes = codes.astype(dtype)
+    
+    return codes[:len(subordinate_variable)], codes[len(subordinate_variable):], vocabulary
+
+def get_block_size(n, block_size = None, max_block_elements = MAX_BLOCK_ELEMENTS):
+    """Return the number of resamples of n measurements to process at once, so that a block holds at most max_block_elements elements.
+    """
+    
+    if block_size is None:
+        block_size = max_block_elements // max(n, 1)
+        
+    return max(int(block_size), 1)
+
+
+def get_seed_sequence(random_state = None):
+    """Return a np.random.SeedSequence from a seed (None or int) or a np.random.Generator, for spawning independent random streams.
+    """
+    
+    if isinstance(random_state, np.random.Generator):
+        return np.random.SeedSequence(random_state.integers(2**63, size = 4))
+    
+    return np.random.SeedSequence(random_state)
+
+def bootstrap_block(arrays, method, n_resamples, rng):
+    """Return bootstrapped discrepancy scores for n_resamples resamples of the per-measurement discrepancy terms arrays['terms'].
+    """
+    
+    terms = arrays['terms']
+    indices = rng.integers(0, len(terms), size = [n_resamples, len(terms)])
+    
+    return np.mean(terms[indices], axis = 1)
+
+def shuffle_block(arrays, method, n_resamples, rng):
+    """Return discrepancy scores for n_resamples random permutations of arrays['supervisor_variable'] against arrays['subordinate_variable'].
+    """
+    
+    subordinate_variable = arrays['subordinate_variable']
+    supervisor_variable = arrays['supervisor_variable']
+    n = len(subordinate_variable)
+    
+    # Each row of indices is an independent permutation of range(n); permuting int64 indices and gathering is faster than permuting small integer codes
+    indices = rng.permuted(np.broadcast_to(np.arange(n, dtype = np.int64), [n_resamples, n]), axis = 1)
+    terms = discrepancy_terms(subordinate_variable, supervisor_variable[indices], method)
+    
+    return np.mean(terms, axis = 1)
+
+RESAMPLING_BLOCKS = {'bootstrap': bootstrap_block, 'shuffle': shuffle_block}
+
+def resample_scores(kind, arrays, method, n_iterations, block_size = None, random_state = None, n_workers = 1):
+    """Generate n_iterations resampled discrepancy scores in blocks, optionally spread over a pool of processes.
+    Every block gets its own random stream spawned from random_state, so the output only depends on random_state and block_size, not on n_workers.
+    With n_workers > 1, the input arrays are copied once into shared memory and attached by each worker, instead of being pickled with every block.
+    
+    Inputs:
+    kind (string): 'bootstrap' or 'shuffle', see RESAMPLING_BLOCKS
+    arrays (dict of 1-D numeric numpy arrays): inputs of the block function, all of the same length
+    method (string): one of METHODS, see discrepancy_score()
+    n_iterations (int): number of resampled discrepancy scores
+    block_size (int, default None): number of resamples scored at once. If None, chosen so that a block holds at most MAX_BLOCK_ELEMENTS elements
+    random_state (None, int or np.random.Generator, default None): seed or generator from which the random streams of all blocks are spawned
+    n_workers (int, default 1): number of processes. If 1, blocks are run in the current process
+    
+    Outputs:
+    discrepancy_scores (array of length n_iterations, float)
+    
+    """
+    
+    n = len(next(iter(arrays.values())))
+    block_size = get_block_size(n, block_size)
+    starts = list(range(0, n_iterations, block_size))
+    sizes = [min(block_size, n_iterations - start) for start in starts]
+    seeds = get_seed_sequence(random_state).spawn(len(starts))
+    
+    if n_workers <= 1:
+        blocks = [RESAMPLING_BLOCKS[kind](arrays, method, size, np.random.default_rng(seed)) for size, seed in zip(sizes, seeds)]
+        return np.concatenate(blocks) if len(blocks) > 0 else np.zeros(0)
+    
+    shared_blocks = {}
+    try:
+        specs = {}
+        for name, array in arrays.items():
+            shared_blocks[name] = shared_memory.SharedMemory(create = True, size = max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype = array.dtype, buffer = shared_blocks[name].buf)[:] = array
+            specs[name] = (shared_blocks[name].name, array.shape, array.dtype.str)
+            
+        with ProcessPoolExecutor(max_workers = n_workers, initializer = attach_shared_arrays, initargs = (specs,)) as executor:
+            blocks = list(executor.map(run_shared_block, [kind]*len(sizes), [method]*len(sizes), sizes, seeds))
+    finally:
+        for shared_block in shared_blocks.values():
+            shared_block.close()
+            shared_block.unlink()
+    
+    return np.concatenate(blocks) if len(blocks) > 0 else np.zeros(0)
+
+# Shared memory blocks and arrays attached by a worker process of resample_scores()
+worker_shared_blocks = {}
+worker_arrays = {}
+
+def attach_shared_arrays(specs):
+    """Worker initializer for resample_scores(): attach the shared memory blocks described by specs ({name: (shared memory name, shape, dtype)}).
+    """
+    
+    for name, (shm_name, shape, dtype) in specs.items():
+        worker_shared_blocks[name] = shared_memory.SharedMemory(name = shm_name)
+        worker_arrays[name] = np.ndarray(shape, dtype = np.dtype(dtype), buffer = worker_shared_blocks[name].buf)
+
+def run_shared_block(kind, method, n_resamples, seed):
+    """Worker task for resample_scores(): score one block of resamples of the arrays attached by attach_shared_arrays().
+    """
+    
+    return RESAMPLING_BLOCKS[kind](worker_arrays, method, n_resamples, np.random.default_rng(seed))
+
+def grouped_discrepancy_score(subordinate_variable, supervisor_variable, subordinate_ids, method):
+    """Calculate the discrepancy score of every subordinate in a single pass, from measurements of all subordinates stacked together.
+    
+    Inputs:
+    subordinate_variable (array, float except if method is 'percent_non_match'): values measured by subordinates
+    supervisor_variable (array): must be of same length and datatype as subordinate_variable, values measured by supervisor
+    subordinate_ids (array): same length as subordinate_variable, ID of the subordinate who made each measurement
+    method (string): one of METHODS, see discrepancy_score()
+    
+    Outputs:
+    unique_ids (array): sorted IDs of subordinates
+    discrepancy_scores (array, float): discrepancy_scores[i] is the discrepancy score of subordinate unique_ids[i]
+    n_measurements (array, int): n_measurements[i] is the number of measurements of subordinate unique_ids[i]
+    
+    """
+    
+    subordinate_variable, supervisor_variable = check_variables(subordinate_variable, supervisor_variable)
+    subordinate_ids = np.reshape(np.asarray(subordinate_ids), [-1])
+    if len(subordinate_ids) != len(subordinate_variable):
+        raise ValueError("subordinate_ids must be the same length as the two variables.")
+    
+    # Factorize IDs into integer group numbers, then sum discrepancy terms within each group
+    unique_ids, group = np.unique(subordinate_ids, return_inverse = True)
+    terms = discrepancy_terms(subordinate_variable, supervisor_variable, method)
+    n_measurements = np.bincount(group, minlength = len(unique_ids))
+    discrepancy_scores = np.bincount(group, weights = terms, minlength = len(unique_ids)) / n_measurements
+    
+    return unique_ids, discrepancy_scores, n_measurements
+
+def pair_variables(subordinate_columns, supervisor_columns, subordinate_suffix = '_aww', supervisor_suffix = '_ss'):
+    """Match subordinate and supervisor columns measuring the same variable, by the name before their suffixes (e.g. 'height_aww' and 'height_ss').
+    
+    Inputs:
+    subordinate_columns (list of strings): column names of subordinate data
+    supervisor_columns (list of strings): column names of supervisor data
+    subordinate_suffix (string, default '_aww'): suffix of subordinate columns
+    supervisor_suffix (string, default '_ss'): suffix of supervisor columns
+    
+    Outputs:
+    pairs (list of tuples): (variable name, subordinate column, supervisor column) for each variable measured by both, in the order of subordinate_columns
+    
+    """
+    
+    supervisor_lookup = {c[:-len(supervisor_suffix)]: c for c in supervisor_columns if c.endswith(supervisor_suffix)}
+    pairs = []
+    for c in subordinate_columns:
+        if c.endswith(subordinate_suffix) and c[:-len(subordinate_suffix)] in supervisor_lookup:
+            variable = c[:-len(subordinate_suffix)]
+            pairs.append((variable, c, supervisor_lookup[variable]))
+    
+    return pairs
+
+def score_paired_variables(subordinate_data, supervisor_data, methods = 'percent_non_match', subordinate_ids = None, subordinate_suffix = '_aww', 
+                           supervisor_suffix = '_ss'):
+    """Calculate discrepancy scores of all variables measured by both subordinate and supervisor, for every subordinate, in one pass over the data.
+    Variables scored by the same method are stacked into 2-D arrays (measurements x variables), scored together and summed per subordinate 
+    with a single segment reduction.
+    
+    Inputs:
+    subordinate_data (pandas DataFrame): subordinate measurements, one column per variable named <variable><subordinate_suffix>
+    supervisor_data (pandas DataFrame): supervisor measurements of the same rows, one column per variable named <variable><supervisor_suffix>. 
+                                        May be the same DataFrame as subordinate_data
+    methods (string or dict, default 'percent_non_match'): method used for all variables (one of METHODS, see discrepancy_score()), 
+                                                          or dict {variable name: method}. Paired variables missing from the dict are not scored
+    subordinate_ids (string or array, default None): column of subordinate_data, or array, with the ID of the subordinate who made each measurement. 
+                                                    If None, all measurements are scored together
+    subordinate_suffix (string, default '_aww'): suffix of subordinate columns
+    supervisor_suffix (string, default '_ss'): suffix of supervisor columns
+    
+    Outputs:
+    scores (pandas DataFrame): one row per subordinate and variable, with columns 'subordinate_id' (only if subordinate_ids is given), 
+                               'variable', 'method', 'discrepancy_score' and 'n_measurements'
+    
+    """
+    
+    import pandas as pd
+    
+    if len(subordinate_data) != len(supervisor_data):
+        raise ValueError("subordinate_data and supervisor_data must have the same number of rows.")
+    
+    pairs = pair_variables(list(subordinate_data.columns), list(supervisor_data.columns), subordinate_suffix = subordinate_suffix, 
+                           supervisor_suffix = supervisor_suffix)
+    if isinstance(methods, str):
+        methods = {variable: methods for variable, sub_column, sup_column in pairs}
+    pairs = [pair for pair in pairs if pair[0] in methods]
+    
+    # Sort rows by subordinate once, so that every variable can be summed per subordinate with np.add.reduceat
+    if subordinate_ids is None:
+        unique_ids = np.zeros(1)
+        order = np.arange(len(subordinate_data))
+        starts = np.zeros(1, dtype = int)
+    else:
+        if isinstance(subordinate_ids, str):
+            subordinate_ids = subordinate_data[subordinate_ids]
+        unique_ids, group = np.unique(np.asarray(subordinate_ids), return_inverse = True)
+        group = np.reshape(group, [-1])
+        order = np.argsort(group, kind = 'stable')
+        starts = np.searchsorted(group[order], np.arange(len(unique_ids)))
+    n_measurements = np.diff(np.append(starts, len(order)))
+    
+    tables = []
+    for method in dict.fromkeys(methods[variable] for variable, sub_column, sup_column in pairs):
+        method_pairs = [pair for pair in pairs if methods[pair[0]] == method]
+        sub_columns = [sub_column for variable, sub_column, sup_column in method_pairs]
+        sup_columns = [sup_column for variable, sub_column, sup_column in method_pairs]
+        
+        subordinate_values = subordinate_data[sub_columns].to_numpy()[order]
+        supervisor_values = supervisor_data[sup_columns].to_numpy()[order]
+        if method != 'percent_non_match':
+            subordinate_values = subordinate_values.astype(float)
+            supervisor_values = supervisor_values.astype(float)
+        
+        terms = discrepancy_terms(subordinate_values, supervisor_values, method)
+        scores = np.add.reduceat(terms, starts, axis = 0) / n_measurements[:, None]
+        
+        table = {'variable': np.tile([pair[0] for pair in method_pairs], len(unique_ids)), 
+                 'method': method, 
+                 'discrepancy_score': np.reshape(scores, [-1]), 
+                 'n_measurements': np.repeat(n_measurements, len(method_pairs))}
+        if subordinate_ids is not None:
+            table = {'subordinate_id': np.repeat(unique_ids, len(method_pairs)), **table}
+        tables.append(pd.DataFrame(table))
+    
+    if len(tables) == 0:
+        return pd.DataFrame(columns = (['subordinate_id'] if subordinate_ids is not None else []) + ['variable', 'method', 'discrepancy_score', 'n_measurements'])
+    
+    return pd.concat(tables, ignore_index = True)
 
+class DiscrepancyAccumulator:
+    """Running discrepancy score of one method, updated from chunks of measurements in O(chunk size) and mergeable across chunks, processes or districts.
+    Difference-based methods keep the count, Welford mean and sum of squared deviations of the per-measurement discrepancy terms; 
+    'percent_non_match' keeps the count of measurements and of mismatches.
+    
+    Example:
+    acc = DiscrepancyAccumulator('absolute_difference')
+    acc.update(sub_day_1, sup_day_1)
+    acc.update(sub_day_2, sup_day_2)
+    acc.score(), acc.standard_error()
+    
+    """
+    
+    def __init__(self, method, n = 0, mean = 0.0, m2 = 0.0, n_non_match = 0):
+        
+        if method not in METHODS:
+            raise ValueError(METHOD_ERROR_MESSAGE)
+        self.method = method
+        self.n = int(n) # Number of measurements
+        self.mean = float(mean) # Mean of discrepancy terms (difference-based methods)
+        self.m2 = float(m2) # Sum of squared deviations of discrepancy terms from their mean (difference-based methods)
+        self.n_non_match = int(n_non_match) # Number of measurements that do not match ('percent_non_match')
+        
+    def update(self, subordinate_variable, supervisor_variable):
+        """Add a chunk of measurements. Returns self, so that calls can be chained.
+        """
+        
+        subordinate_variable, supervisor_variable = check_variables(subordinate_variable, supervisor_variable)
+        
+        if self.method == 'percent_non_match':
+            self.n += len(subordinate_variable)
+            self.n_non_match += int(np.sum(subordinate_variable != supervisor_variable))
+        else:
+            terms = discrepancy_terms(subordinate_variable, supervisor_variable, self.method)
+            chunk_mean = np.mean(terms)
+            self.combine(len(terms), chunk_mean, np.sum((terms - chunk_mean)**2))
+            
+        return self
+    
+    def merge(self, other):
+        """Add the measurements summarized by another accumulator of the same method. Returns self, so that calls can be chained.
+        """
+        
+        if other.method != self.method:
+            raise ValueError("Only accumulators of the same method can be merged.")
+        
+        if self.method == 'percent_non_match':
+            self.n += other.n
+            self.n_non_match += other.n_non_match
+        else:
+            self.combine(other.n, other.mean, other.m2)
+        
+        return self
+    
+    def combine(self, n, mean, m2):
+        """Combine running count, mean and sum of squared deviations with those of another set of discrepancy terms (Chan et al. parallel update).
+        """
+        
+        if n == 0:
+            return
+        n_total = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * n / n_total
+        self.m2 += m2 + delta**2 * self.n * n / n_total
+        self.n = n_total
+        
+    def score(self):
+        """Return the discrepancy score of all measurements so far (same as discrepancy_score() on all of them), or np.nan if there are none.
+        """
+        
+        if self.n == 0:
+            return np.nan
+        if self.method == 'percent_non_match':
+            return self.n_non_match / self.n * 100
+        
+        return self.mean
+    
+    def standard_error(self):
+        """Return the standard error of the discrepancy score, or np.nan if there are fewer than 2 measurements.
+        """
+        
+        if self.n < 2:
+            return np.nan
+        if self.method == 'percent_non_match':
+            rate = self.n_non_match / self.n
+            return np.sqrt(rate * (1 - rate) / self.n) * 100
+        
+        return np.sqrt(self.m2 / (self.n - 1) / self.n)
+    
+    def to_dict(self):
+        """Return the state of the accumulator as a small dict of plain numbers, e.g. for storing as JSON.
+        """
+        
+        if self.method == 'percent_non_match':
+            return {'method': self.method, 'n': self.n, 'n_non_match': self.n_non_match}
+        
+        return {'method': self.method, 'n': self.n, 'mean': self.mean, 'm2': self.m2}
+    
+    @classmethod
+    def from_dict(cls, state):
+        """Rebuild an accumulator from the output of to_dict().
+        """
+        
+        return cls(**state)
+    
+    def __repr__(self):
+        return '<DiscrepancyAccumulator {0}: n = {1}, score = {2}>'.format(self.method, self.n, self.score())
 
-def bootstrap_distribution(subordinate_variable, supervisor_variable, method, n_iterations = 100000, ax = None):
+def bootstrap_distribution(subordinate_variable, supervisor_variable, method, n_iterations = 100000, ax = None, make_plot = True, block_size = None, 
+                           random_state = None, n_workers = 1, analytic = True):
     """Generate a distribution of discrepancy scores between the two variables using bootstrapping.
+    Resamples are drawn and scored in blocks of block_size iterations, so that memory use is bounded by block_size x len(subordinate_variable).
     
     Inputs:
     subordinate_variable (array, float except if method is 'percent_non_match'): values measured by subordinate
@@ -67,37 +504,116 @@ def bootstrap_distribution(subordinate_variable, supervisor_variable, method, n_
                                 subordinate_variable and supervisor_variable may be of any datatype.
     n_iterations (int, default 100000): Number of values in null distribution
     ax (plt.axes() instance, default None): axes for plotting null distribution
+    make_plot (bool, default True): if False, no plot is made and ax is ignored
+    block_size (int, default None): number of iterations scored at once. If None, chosen so that a block holds at most MAX_BLOCK_ELEMENTS elements
+    random_state (None, int or np.random.Generator, default None): seed or generator for drawing resamples
+    n_workers (int, default 1): number of processes to spread blocks over. Results for a given random_state do not depend on n_workers
+    analytic (bool, default True): if True and method is 'percent_non_match', draw directly from the exact bootstrap distribution 
+                                   (Binomial(n, observed mismatch rate)/n, see percent_non_match_bootstrap()) instead of resampling measurements
     
     Outputs:
     discrepancy_scores (array of length n_iterations, float): simulated discrepancy scores with random sub-sampling of measurements
     """
+    
+    subordinate_variable, supervisor_variable = check_variables(subordinate_variable, supervisor_variable)
+    
+    if analytic and method == 'percent_non_match':
+        # The number of mismatches in a resample of n measurements is Binomial(n, observed mismatch rate)
+        n = len(subordinate_variable)
+        n_non_match = np.sum(subordinate_variable != supervisor_variable)
+        rng = np.random.default_rng(get_seed_sequence(random_state))
+        discrepancy_scores = rng.binomial(n, n_non_match / n, size = n_iterations) / n * 100
+    else:
+        # Resampling pairs of measurements and averaging their discrepancies is the same as resampling the per-measurement discrepancies
+        terms = discrepancy_terms(subordinate_variable, supervisor_variable, method)
+        discrepancy_scores = resample_scores('bootstrap', {'terms': terms}, method, n_iterations, block_size = block_size, random_state = random_state, 
+                                             n_workers = n_workers)
         
-    n = len(subordinate_variable)
-    discrepancy_scores = []
+    if make_plot:
+        real_discrepancy_score = discrepancy_score(subordinate_variable, supervisor_variable, method)
+        plot_distribution(discrepancy_scores, real_discrepancy_score, "Bootstrap Distribution of Discrepancy Scores", ax = ax, 
+                          label = 'True discrepancy score')
 
-    for i in tqdm(range(n_iterations)):
-        indices = np.random.choice(range(n), size=n, replace=True)
-        random_sample_sub = np.array([subordinate_variable[j] for j in indices])
-        random_sample_sup = np.array([supervisor_variable[j] for j in indices])
+    return discrepancy_scores
 
-        discrepancy_scores.append(discrepancy_score(random_sample_sub, random_sample_sup, method))
+def percent_non_match_bootstrap(subordinate_variable, supervisor_variable, quantiles = (0.025, 0.5, 0.975)):
+    """Return the exact bootstrap distribution of the 'percent_non_match' discrepancy score, without simulation.
+    A bootstrap resample of n measurements contains Binomial(n, observed mismatch rate) mismatches, so the resampled score is that count / n * 100.
+    
+    Inputs:
+    subordinate_variable (array): values measured by subordinate
+    supervisor_variable (array): must be of same length and datatype as subordinate_variable, values measured by supervisor
+    quantiles (array, float between 0 and 1, default (0.025, 0.5, 0.975)): quantiles of the bootstrap distribution to return
+    
+    Outputs:
+    output (dict):
+        'scores' (array of length n + 1, float): possible resampled discrepancy scores, k / n * 100 for k = 0, ..., n mismatches
+        'pmf' (array of length n + 1, float): probability of each score in 'scores'
+        'quantiles' (array, float): discrepancy scores at the requested quantiles
         
-    real_discrepancy_score = discrepancy_score(subordinate_variable, supervisor_variable, method)
+    """
     
-    if ax is None:
-        fig, ax = plt.subplots()
-    ax.hist(discrepancy_scores, color = 'gray', edgecolor = 'black')
-    ax.axvline(real_discrepancy_score, color='r', linestyle='dashed', linewidth=2, label = 'True discrepancy score')
-    plt.legend()
-    ax.set_xlabel("Discrepancy Score")
-    ax.set_ylabel("Frequency")
-    ax.set_title("Bootstrap Distribution of Discrepancy Scores")
+    from scipy.stats import binom
+    
+    subordinate_variable, supervisor_variable = check_variables(subordinate_variable, supervisor_variable)
+    n = len(subordinate_variable)
+    rate = np.sum(subordinate_variable != supervisor_variable) / n
+    
+    k = np.arange(n + 1)
+    output = {'scores': k / n * 100, 'pmf': binom.pmf(k, n, rate), 'quantiles': binom.ppf(quantiles, n, rate) / n * 100}
+    
+    return output
 
+def poisson_bootstrap_distribution(chunks, method, n_iterations = 1000, block_size = None, random_state = None):
+    """Generate a bootstrap distribution of discrepancy scores in one streaming pass over chunks of measurements, using the Poisson bootstrap: 
+    instead of drawing n indices per resample, every measurement gets an independent Poisson(1) weight in every resample. 
+    Only the running weighted sums of each resample are kept, so memory does not grow with the total number of measurements.
+    For large n this matches the uncertainty of bootstrap_distribution().
+    
+    Inputs:
+    chunks (iterable): pairs (subordinate_variable, supervisor_variable) of arrays, e.g. iterate_chunks() or chunks read from a file
+    method (string): one of METHODS, see discrepancy_score()
+    n_iterations (int, default 1000): Number of values in bootstrap distribution
+    block_size (int, default None): number of measurements weighted at once. If None, chosen so that a block holds at most MAX_BLOCK_ELEMENTS weights
+    random_state (None, int or np.random.Generator, default None): seed or generator for drawing weights. Results also depend on how data is chunked
+    
+    Outputs:
+    discrepancy_scores (array of length n_iterations, float): bootstrapped discrepancy scores
+    
+    """
+    
+    rng = np.random.default_rng(random_state)
+    block_size = get_block_size(n_iterations, block_size)
+    weighted_sums = np.zeros(n_iterations)
+    weight_totals = np.zeros(n_iterations)
+    
+    for subordinate_variable, supervisor_variable in chunks:
+        subordinate_variable, supervisor_variable = check_variables(subordinate_variable, supervisor_variable)
+        terms = discrepancy_terms(subordinate_variable, supervisor_variable, method)
+        
+        for start in range(0, len(terms), block_size):
+            block_terms = terms[start:start + block_size]
+            weights = rng.poisson(1, size = [n_iterations, len(block_terms)]).astype(float)
+            weighted_sums += weights @ block_terms
+            weight_totals += np.sum(weights, axis = 1)
+            
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        discrepancy_scores = weighted_sums / weight_totals
+    
     return discrepancy_scores
 
-def shuffle_distribution(subordinate_variable, supervisor_variable, method, n_iterations = 100000, ax = None):
+def iterate_chunks(subordinate_variable, supervisor_variable, chunk_size = 100000):
+    """Yield pairs of consecutive chunks of chunk_size measurements from the subordinate and supervisor variables, e.g. for poisson_bootstrap_distribution().
+    """
+    
+    for start in range(0, len(subordinate_variable), chunk_size):
+        yield subordinate_variable[start:start + chunk_size], supervisor_variable[start:start + chunk_size]
+
+def shuffle_distribution(subordinate_variable, supervisor_variable, method, n_iterations = 100000, ax = None, make_plot = True, block_size = None, 
+                         random_state = None, n_workers = 1):
     """Generate a null distribution of discrepancy scores between the two variables 
     by shuffling indices of the supervisor variable.
+    Permutations are generated and scored in blocks of block_size iterations, so that memory use is bounded by block_size x len(subordinate_variable).
     
     Inputs:
     subordinate_variable:
@@ -111,31 +627,29 @@ def shuffle_distribution(subordinate_variable, supervisor_variable, method, n_it
                                 subordinate_variable and supervisor_variable may be of any datatype.
     n_iterations (int, default 100000): Number of values in null distribution
     ax (plt.axes() instance, default None): axes for plotting null distribution
+    make_plot (bool, default True): if False, no plot is made and ax is ignored
+    block_size (int, default None): number of permutations scored at once. If None, chosen so that a block holds at most MAX_BLOCK_ELEMENTS elements
+    random_state (None, int or np.random.Generator, default None): seed or generator for drawing permutations
+    n_workers (int, default 1): number of processes to spread blocks over. Results for a given random_state do not depend on n_workers
     
     Outputs:
     discrepancy_scores (array of length n_iterations, float): simulated discrepancy scores with indices of supervisor variable shuffled 
     
     """
-        
-    n = len(subordinate_variable)
-    discrepancy_scores = []
-    subordinate_variable_array = np.array([subordinate_variable[j] for j in range(n)])
-
-    for i in tqdm(range(n_iterations)):
-        indices = np.random.choice(range(n), size=n, replace=False)
-        random_sample_sup = np.array([supervisor_variable[j] for j in indices])
-
-        discrepancy_scores.append(discrepancy_score(subordinate_variable_array, random_sample_sup, method))
-        
-    real_discrepancy_score = discrepancy_score(subordinate_variable, supervisor_variable, method)
     
-    if ax is None:
-        fig, ax = plt.subplots()
-    ax.hist(discrepancy_scores, color = 'gray', edgecolor = 'black')
-    ax.axvline(real_discrepancy_score, color='r', linestyle='dashed', linewidth=2)
-    ax.set_xlabel("Discrepancy Score")
-    ax.set_ylabel("Frequency")
-    ax.set_title("Shuffled Null Distribution of Discrepancy Scores")
+    subordinate_variable, supervisor_variable = check_variables(subordinate_variable, supervisor_variable)
+    if method == 'percent_non_match':
+        # Compare and permute compact integer codes instead of the raw (possibly object) values; this also lets them be placed in shared memory
+        subordinate_codes, supervisor_codes, vocabulary = encode_categorical(subordinate_variable, supervisor_variable)
+        arrays = {'subordinate_variable': subordinate_codes, 'supervisor_variable': supervisor_codes}
+    else:
+        arrays = {'subordinate_variable': subordinate_variable, 'supervisor_variable': supervisor_variable}
+    discrepancy_scores = resample_scores('shuffle', arrays, method, n_iterations, block_size = block_size, random_state = random_state, 
+                                         n_workers = n_workers)
+    
+    if make_plot:
+        real_discrepancy_score = discrepancy_score(subordinate_variable, supervisor_variable, method)
+        plot_distribution(discrepancy_scores, real_discrepancy_score, "Shuffled Null Distribution of Discrepancy Scores", ax = ax)
 
     return discrepancy_scores
 
@@ -152,6 +666,119 @@ def p_value(shuffle_distribution, real_value):
     
     """
     
-    p_value = sum(shuffle_distribution <= real_value) / len(shuffle_distribution)
+    p_value = np.sum(np.asarray(shuffle_distribution) <= real_value) / len(shuffle_distribution)
+    
+    return p_value
+
+def p_values(shuffle_distribution, real_values, alternative = 'less', correction = 'holm'):
+    """Calculate p-values of many real discrepancy scores at once. 
+    A shared null distribution (1-D) is sorted once and every real value is located in it with np.searchsorted. 
+    If each real value has its own null distribution (2-D, one row per real value), the counts are taken in a single vectorized comparison.
+    
+    Inputs:
+    shuffle_distribution (array, float): discrepancy scores simulated under the null hypothesis. Either 1-D, shared by all real values, 
+                                         or 2-D with shuffle_distribution[i] the null distribution of real_values[i]
+    real_values (array, float): observed discrepancy scores, e.g. one per subordinate
+    alternative (string, default 'less'): One of the following options:
+        1. 'less': proportion of the null distribution <= real value (same as p_value())
+        2. 'greater': proportion of the null distribution >= real value
+        3. 'two-sided': twice the smaller of the two one-sided p-values, capped at 1
+    correction (string or None, default 'holm'): multiple comparison correction across all real values, see correct_p_values()
+    
+    Output:
+    output (dict):
+        'p_values' (array, same shape as real_values): uncorrected p-values
+        'p_values_corrected' (array, same shape as real_values): p-values after correction, or None if correction is None
+    
+    """
     
-    return p_value
\ No newline at end of file
+    shuffle_distribution = np.asarray(shuffle_distribution, dtype = float)
+    real_values = np.asarray(real_values, dtype = float)
+    
+    if shuffle_distribution.ndim == 1:
+        n_null = len(shuffle_distribution)
+        sorted_null = np.sort(shuffle_distribution)
+        n_less_equal = np.searchsorted(sorted_null, real_values, side = 'right')
+        n_greater_equal = n_null - np.searchsorted(sorted_null, real_values, side = 'left')
+    elif shuffle_distribution.ndim == 2:
+        if shuffle_distribution.shape[0] != real_values.size:
+            raise ValueError("A 2-D shuffle_distribution must have one row per real value.")
+        n_null = shuffle_distribution.shape[1]
+        column = np.reshape(real_values, [-1, 1])
+        n_less_equal = np.reshape(np.sum(shuffle_distribution <= column, axis = 1), real_values.shape)
+        n_greater_equal = np.reshape(np.sum(shuffle_distribution >= column, axis = 1), real_values.shape)
+    else:
+        raise ValueError("shuffle_distribution must be 1-D or 2-D.")
+    
+    if alternative == 'less':
+        p = n_less_equal / n_null
+    elif alternative == 'greater':
+        p = n_greater_equal / n_null
+    elif alternative == 'two-sided':
+        p = np.minimum(2 * np.minimum(n_less_equal, n_greater_equal) / n_null, 1)
+    else:
+        raise ValueError("alternative must be one of the following: less, greater, or two-sided.")
+    
+    output = {'p_values': p, 'p_values_corrected': None}
+    if correction is not None:
+        output['p_values_corrected'] = correct_p_values(p, correction)
+    
+    return output
+
+def correct_p_values(p_values, correction = 'holm'):
+    """Correct p-values for multiple comparisons, treating all elements of p_values as one family.
+    
+    Inputs:
+    p_values (array, float): uncorrected p-values
+    correction (string, default 'holm'): One of the following options:
+        1. 'bonferroni': multiply by the number of comparisons
+        2. 'holm': Holm-Bonferroni step-down correction (controls family-wise error rate)
+        3. 'fdr_bh': Benjamini-Hochberg correction (controls false discovery rate)
+        
+    Output:
+    p_values_corrected (array, same shape as p_values)
+    
+    """
+    
+    p_values = np.asarray(p_values, dtype = float)
+    p = np.reshape(p_values, [-1])
+    m = len(p)
+    
+    if correction == 'bonferroni':
+        corrected = p * m
+    elif correction == 'holm':
+        order = np.argsort(p)
+        corrected = np.zeros(m)
+        corrected[order] = np.maximum.accumulate(p[order] * (m - np.arange(m)))
+    elif correction == 'fdr_bh':
+        order = np.argsort(p)[::-1]
+        corrected = np.zeros(m)
+        corrected[order] = np.minimum.accumulate(p[order] * m / (m - np.arange(m)))
+    else:
+        raise ValueError("correction must be one of the following: bonferroni, holm, or fdr_bh.")
+    
+    return np.reshape(np.minimum(corrected, 1), p_values.shape)
+
+def plot_distribution(discrepancy_scores, real_discrepancy_score, title, ax = None, label = None):
+    """Plot a histogram of simulated discrepancy scores, with the observed discrepancy score marked.
+    
+    Inputs:
+    discrepancy_scores (array, float): simulated discrepancy scores, e.g. output of bootstrap_distribution() or shuffle_distribution()
+    real_discrepancy_score (float): observed discrepancy score
+    title (string): title of the plot
+    ax (plt.axes() instance, default None): axes for plotting distribution
+    label (string, default None): legend label for the observed discrepancy score. If None, no legend is drawn
+    
+    """
+    
+    import matplotlib.pyplot as plt
+    
+    if ax is None:
+        fig, ax = plt.subplots()
+    ax.hist(discrepancy_scores, color = 'gray', edgecolor = 'black')
+    ax.axvline(real_discrepancy_score, color='r', linestyle='dashed', linewidth=2, label = label)
+    if label is not None:
+        ax.legend()
+    ax.set_xlabel("Discrepancy Score")
+    ax.set_ylabel("Frequency")
+    ax.set_title(title)
@@ -0,0 +1,50 @@
+import subprocess
+import sys
+from os.path import dirname, abspath
+
+# Modules imported by web workers and batch jobs, named as they are imported from the repository root (e.g. by webapp/routes.py)
+MODULES = ['Scripts.binomial_confidence', 'Scripts.disc_score', 'Scripts.multi_sub_binomial_prediction']
+
+# Modules that should not be loaded by importing the compute modules above
+PLOTTING_MODULES = ['matplotlib', 'pandas', 'tqdm']
+
+MEASURE_CODE = '''
+import sys, time
+start = time.perf_counter()
+import {0}
+print(time.perf_counter() - start)
+print(','.join([m for m in {1} if m in sys.modules]))
+'''
+
+def measure_import_time(module, n_repeats = 5):
+    """ Measure the cold-start time of importing a module, each repeat in a fresh python interpreter started from the repository root.
+
+        Inputs:
+        module: name of module to import, e.g. 'Scripts.binomial_confidence'
+        n_repeats: default 5, number of fresh interpreters to time
+
+        Outputs:
+        output: dict with 'median' and 'min' import time in seconds, and 'plotting_modules', the modules from PLOTTING_MODULES loaded by the import
+    """
+
+    root = dirname(dirname(abspath(__file__)))
+    times = []
+
+    for repeat in range(n_repeats):
+        result = subprocess.run([sys.executable, '-c', MEASURE_CODE.format(module, PLOTTING_MODULES)], cwd = root, capture_output = True, text = True,
+                                check = True)
+        lines = result.stdout.splitlines()
+        times.append(float(lines[0]))
+        loaded = [m for m in lines[1].split(',') if m != ''] if len(lines) > 1 else []
+
+    times.sort()
+    output = {'median': times[len(times)//2], 'min': times[0], 'plotting_modules': loaded}
+
+    return output
+
+if __name__ == '__main__':
+
+    for module in MODULES:
+        output = measure_import_time(module)
+        print('{0}: median {1:.3f} s, min {2:.3f} s, plotting modules loaded: {3}'.format(module, output['median'], output['min'],
+                                                                                           output['plotting_modules'] or 'none'))
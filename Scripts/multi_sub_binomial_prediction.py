@@ -1,12 +1,27 @@
-import matplotlib.pyplot as plt
+import time
+import tracemalloc
 import numpy as np
-import pandas as pd
-from os.path import sep
-from tqdm import tqdm
-from scipy.stats import binom
-from matplotlib.patches import Rectangle
-import numpy as np
-from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from scipy.stats import binom, beta, norm
+
+# Seeding rule shared with disc_score. Scripts are imported both as a package (from Scripts import ..., e.g. by the webapp) and as flat modules 
+# (e.g. by the notebooks in Scripts)
+try:
+    from .disc_score import get_seed_sequence
+except ImportError:
+    from disc_score import get_seed_sequence
+
+# Largest number of array elements (simulations x subordinates) held in memory at once by the batched simulations
+MAX_BLOCK_ELEMENTS = 2**22
+
+# Confidence intervals on a catch frequency supported by get_freq_interval()
+INTERVAL_METHODS = ['wilson', 'clopper_pearson']
+
+# Measurement noise models supported by analytic_catch_probability()
+NOISE_MODELS = ['binomial', 'normal']
+
+# Default largest number of chunks the simulations of parallel_sample_size_simulation() are split into, independent of the number of workers
+MAX_CHUNKS = 128
 
 def binary_search(min_n_samples, max_n_samples, n_sub, n_punish, n_guarantee, confidence = 0.9, n_simulations = 100, min_disc = 0, max_disc = 1, distribution = 'uniform'):
     """ Find the least number of samples between min_n_samples and max_n_samples, such that n_guarantee worst offenders are caught with the specified confidence.
@@ -61,6 +76,104 @@ def binary_search(min_n_samples, max_n_samples, n_sub, n_punish, n_guarantee, co
 
     return n_high
 
+def adaptive_binary_search(min_n_samples, max_n_samples, n_sub, n_punish, n_guarantee, confidence = 0.9, batch_size = 20, max_simulations = 1000, 
+                           interval_level = 0.95, interval_method = 'wilson', min_disc = 0, max_disc = 1, distribution = 'uniform', random_state = None, 
+                           max_block_elements = MAX_BLOCK_ELEMENTS):
+    """ Version of binary_search() with an adaptive number of simulations per probe. At each probed number of samples, simulations are added in batches 
+        of batch_size until a confidence interval on the frequency with which n_guarantee worst offenders are caught lies entirely above or at/below 
+        confidence, or max_simulations are reached (the probe is then decided by the frequency itself). Probes far from the boundary stop after a few 
+        batches, and simulations are spent on the numbers of samples where the decision is uncertain.
+        Assumes random sampling and binary discrepancy (% mismatch between sub and sup).
+        
+        Inputs:
+        min_n_samples, max_n_samples, n_sub, n_punish, n_guarantee, confidence, min_disc, max_disc, distribution: as in binary_search()
+        batch_size: default 20, number of simulations added at a time
+        max_simulations: default 1000, largest number of simulations per probe
+        interval_level: default 0.95, confidence level of the interval on the catch frequency
+        interval_method: default 'wilson', one of INTERVAL_METHODS
+        random_state: optional, np.random.Generator or seed for true and measured discrepancies
+        max_block_elements: default MAX_BLOCK_ELEMENTS, largest number of (simulation x subordinate) measurements held in memory at once
+        
+        Outputs:
+        output: dict with 
+            'n_samples': least number of samples per subordinate, between min_n_samples and max_n_samples for which n_guarantee worst offenders will be caught
+            'probes': list of dicts, one per probed number of samples in the order probed, with 'n_samples', 'n_simulations', 'freq', 'freq_low', 
+                      'freq_high', 'interval_width' and 'enough'
+            'n_simulations': total number of simulations run
+            'message'
+    """
+    
+    if interval_method not in INTERVAL_METHODS:
+        raise ValueError('interval_method should be one of {0}'.format(INTERVAL_METHODS))
+    
+    rng = np.random.default_rng(random_state)
+    probes = []
+    
+    def probe(n_samples):
+        true_disc = generate_true_disc(n_sub, min_disc = min_disc, max_disc = max_disc, distribution = distribution, random_state = rng)
+        n_caught = 0
+        n_simulations = 0
+        while n_simulations < max_simulations:
+            n_batch = min(batch_size, max_simulations - n_simulations)
+            frac_caught = simulate_frac_caught(true_disc, n_samples, n_punish, n_batch, rng, max_block_elements = max_block_elements)
+            n_caught += np.sum(frac_caught >= n_guarantee/n_punish)
+            n_simulations += n_batch
+            freq_low, freq_high = get_freq_interval(n_caught, n_simulations, level = interval_level, method = interval_method)
+            if freq_low > confidence or freq_high <= confidence:
+                break
+        freq = float(n_caught/n_simulations)
+        # Without a decision from the interval after max_simulations, the probe is decided as in binary_search()
+        enough = bool(freq > confidence)
+        probes.append({'n_samples': n_samples, 'n_simulations': n_simulations, 'freq': freq, 'freq_low': float(freq_low), 'freq_high': float(freq_high), 
+                       'interval_width': float(freq_high - freq_low), 'enough': enough})
+        return enough
+    
+    output = {'probes': probes}
+    
+    if not probe(max_n_samples):
+        output['n_samples'] = max_n_samples
+        output['message'] = 'Increase maximum # samples'
+    elif probe(min_n_samples):
+        output['n_samples'] = min_n_samples
+        output['message'] = 'Decrease minimum # samples'
+    else:
+        n_low = min_n_samples
+        n_high = max_n_samples
+        while n_low < n_high - 1:
+            n_mid = int((n_low + n_high)/2)
+            if probe(n_mid):
+                n_high = n_mid
+            else:
+                n_low = n_mid
+        output['n_samples'] = n_high
+        output['message'] = '{0} samples per subordinate catch {1} of the {2} worst offenders with confidence {3}'.format(n_high, n_guarantee, n_punish, 
+                                                                                                                     confidence)
+    
+    output['n_simulations'] = sum([p['n_simulations'] for p in probes])
+    
+    return output
+
+def get_freq_interval(n_caught, n_simulations, level = 0.95, method = 'wilson'):
+    """ Return the lower and upper bounds of a two-sided confidence interval, at confidence level level, on a frequency estimated as n_caught/n_simulations.
+        method: 'wilson' (score interval) or 'clopper_pearson' (exact, conservative)
+    """
+    
+    alpha = 1 - level
+    
+    if method == 'wilson':
+        z = norm.ppf(1 - alpha/2)
+        freq = n_caught/n_simulations
+        center = (freq + z**2/(2*n_simulations))/(1 + z**2/n_simulations)
+        half_width = z*np.sqrt(freq*(1 - freq)/n_simulations + z**2/(4*n_simulations**2))/(1 + z**2/n_simulations)
+        return max(center - half_width, 0), min(center + half_width, 1)
+    
+    if method == 'clopper_pearson':
+        freq_low = beta.ppf(alpha/2, n_caught, n_simulations - n_caught + 1) if n_caught > 0 else 0
+        freq_high = beta.ppf(1 - alpha/2, n_caught + 1, n_simulations - n_caught) if n_caught < n_simulations else 1
+        return freq_low, freq_high
+    
+    raise ValueError('method should be one of {0}'.format(INTERVAL_METHODS))
+
 def get_freq_of_frac_caught(frac_caught_distribution, frac_caught_threshold):
     
     return np.sum(frac_caught_distribution >= frac_caught_threshold)/len(frac_caught_distribution)
@@ -93,14 +206,538 @@ def single_sample_size_simulation(n_sub, n_samples, n_punish, n_simulations = 10
         
     return frac_caught
 
-def generate_true_disc(n_sub, min_disc = 0, max_disc = 1, distribution = 'uniform'):
+def batch_sample_size_simulation(n_sub, n_samples, n_punish, n_simulations = 100, min_disc = 0, max_disc = 1, distribution = 'uniform', random_state = None, 
+                                 max_block_elements = MAX_BLOCK_ELEMENTS):
+    """ Batched version of single_sample_size_simulation(): simulate discrepancy score measurements for a number of subordinates and report the fraction 
+        of worst offenders caught. Measurements of a block of simulations are drawn as one (simulations x n_sub) binomial matrix from a single generator, 
+        the measured worst offenders of every row are selected with argpartition, and overlap with the true worst offenders is counted with a boolean mask.
+        Assumes random sampling and binary discrepancy (% mismatch between sub and sup).
+        
+        Inputs:
+        n_sub, n_samples, n_punish, n_simulations, min_disc, max_disc, distribution: as in single_sample_size_simulation()
+        random_state: optional, np.random.Generator or seed for true and measured discrepancies
+        max_block_elements: default MAX_BLOCK_ELEMENTS, largest number of (simulation x subordinate) measurements held in memory at once
+        
+        Outputs:
+        frac_caught: 1Xn_simulations array of fraction of worst offenders caught in each simulation
+    """
+    
+    rng = np.random.default_rng(random_state)
+    true_disc = generate_true_disc(n_sub, min_disc = min_disc, max_disc = max_disc, distribution = distribution, random_state = rng)
+    
+    return simulate_frac_caught(true_disc, n_samples, n_punish, n_simulations, rng, max_block_elements = max_block_elements)
+
+def simulate_frac_caught(true_disc, n_samples, n_punish, n_simulations, rng, max_block_elements = MAX_BLOCK_ELEMENTS):
+    """ Simulate n_simulations measurements of subordinates with true discrepancies true_disc, in blocks of at most max_block_elements measurements 
+        drawn from the np.random.Generator rng, and return the fraction of the n_punish worst offenders caught in each simulation.
+    """
+    
+    n_sub = len(true_disc)
+    is_true_worst = get_worst_offenders_mask(true_disc, n_punish)
+    
+    block_size = max(max_block_elements // max(n_sub, 1), 1)
+    frac_caught = np.zeros(n_simulations)
+    
+    for start in range(0, n_simulations, block_size):
+        stop = min(start + block_size, n_simulations)
+        # Measured discrepancies are counts / n_samples, so ranking counts ranks measured discrepancies
+        meas_counts = rng.binomial(n_samples, true_disc, size = [stop - start, n_sub])
+        meas_worst = get_worst_offenders_batch(meas_counts, n_punish)
+        frac_caught[start:stop] = np.sum(is_true_worst[meas_worst], axis = 1)/n_punish
+        
+    return frac_caught
+
+def parallel_sample_size_simulation(n_sub, n_samples, n_punish, n_simulations = 100, min_disc = 0, max_disc = 1, distribution = 'uniform', random_state = None, 
+                                    n_workers = 1, chunk_size = None, max_block_elements = MAX_BLOCK_ELEMENTS):
+    """ Parallel version of batch_sample_size_simulation(): the simulations are split into chunks run on a pool of n_workers processes, and the 
+        fractions caught of all chunks are concatenated in chunk order. True discrepancies and every chunk get their own random stream spawned from 
+        random_state with np.random.SeedSequence, so the output only depends on random_state and chunk_size, and is identical for any n_workers.
+        Assumes random sampling and binary discrepancy (% mismatch between sub and sup).
+        
+        Inputs:
+        n_sub, n_samples, n_punish, n_simulations, min_disc, max_disc, distribution: as in single_sample_size_simulation()
+        random_state: optional, None, seed or np.random.Generator from which all random streams are spawned
+        n_workers: default 1, number of processes. If 1, chunks are run in the current process
+        chunk_size: optional, number of simulations per chunk. If None, simulations are split into at most MAX_CHUNKS chunks of at most 
+                    max_block_elements measurements
+        max_block_elements: default MAX_BLOCK_ELEMENTS, largest number of (simulation x subordinate) measurements held in memory at once by a worker
+        
+        Outputs:
+        frac_caught: 1Xn_simulations array of fraction of worst offenders caught in each simulation
+    """
+    
+    true_seed, chunks_seed = get_seed_sequence(random_state).spawn(2)
+    true_disc = generate_true_disc(n_sub, min_disc = min_disc, max_disc = max_disc, distribution = distribution, 
+                                   random_state = np.random.default_rng(true_seed))
+    
+    if chunk_size is None:
+        chunk_size = min(max(max_block_elements // max(n_sub, 1), 1), -(-n_simulations // MAX_CHUNKS))
+    sizes = [min(chunk_size, n_simulations - start) for start in range(0, n_simulations, max(chunk_size, 1))]
+    seeds = chunks_seed.spawn(len(sizes))
+    
+    if n_workers <= 1:
+        chunks = [run_simulation_chunk(true_disc, n_samples, n_punish, size, seed, max_block_elements) for size, seed in zip(sizes, seeds)]
+    else:
+        n_chunks = len(sizes)
+        with ProcessPoolExecutor(max_workers = n_workers) as executor:
+            chunks = list(executor.map(run_simulation_chunk, [true_disc]*n_chunks, [n_samples]*n_chunks, [n_punish]*n_chunks, sizes, seeds,
+                                       [max_block_elements]*n_chunks))
+    
+    return np.concatenate(chunks) if len(chunks) > 0 else np.zeros(0)
+
+def run_simulation_chunk(true_disc, n_samples, n_punish, n_simulations, seed, max_block_elements = MAX_BLOCK_ELEMENTS):
+    """ Worker task for parallel_sample_size_simulation(): run n_simulations simulations with a generator seeded by the np.random.SeedSequence seed.
+    """
+    
+    return simulate_frac_caught(true_disc, n_samples, n_punish, n_simulations, np.random.default_rng(seed), max_block_elements = max_block_elements)
+
+def compare_two_stage_allocation(n_sub, n_punish, budgets, first_stage_fraction = 0.5, n_near = None, n_guarantee = None, n_simulations = 100, min_disc = 0, 
+                                 max_disc = 1, distribution = 'uniform', random_state = None, max_block_elements = MAX_BLOCK_ELEMENTS):
+    """ Compare two-stage re-sampling against uniform allocation for a range of total sample budgets (samples over all subordinates).
+        Two-stage design (see simulate_frac_caught_two_stage()): a fraction first_stage_fraction of the budget is spread uniformly over all subordinates, 
+        and the rest is spread over the n_near subordinates ranked closest to the n_punish cut by the first stage. Both designs are simulated with the 
+        same true discrepancies. Assumes random sampling and binary discrepancy (% mismatch between sub and sup).
+        
+        Inputs:
+        n_sub, n_punish, n_simulations, min_disc, max_disc, distribution: as in single_sample_size_simulation()
+        budgets: list of total numbers of samples over all subordinates
+        first_stage_fraction: default 0.5, fraction of each budget spent on the uniform first stage
+        n_near: optional, number of subordinates re-sampled in the second stage, default 2*n_punish (at most n_sub)
+        n_guarantee: optional, number of worst offenders that should be caught. If given, frequencies of catching n_guarantee worst offenders are reported
+        random_state: optional, np.random.Generator or seed for true and measured discrepancies
+        max_block_elements: default MAX_BLOCK_ELEMENTS, largest number of (simulation x subordinate) measurements held in memory at once
+        
+        Outputs:
+        output: dict with 
+            'budgets': 1Xlen(budgets) array of budgets
+            'two_stage_budgets', 'uniform_budgets': samples actually spent by each design (budgets rounded down to whole samples per subordinate)
+            'two_stage_frac_caught', 'uniform_frac_caught': n_simulations X len(budgets) arrays of fraction of worst offenders caught
+            'two_stage_mean', 'uniform_mean': mean fraction of worst offenders caught for each budget
+            'two_stage_freq', 'uniform_freq': if n_guarantee is given, frequency with which n_guarantee worst offenders are caught for each budget
+    """
+    
+    if not 0 < first_stage_fraction <= 1:
+        raise ValueError('first_stage_fraction should be larger than 0 and at most 1')
+    if n_near is None:
+        n_near = 2*n_punish
+    n_near = min(n_near, n_sub)
+    
+    rng = np.random.default_rng(random_state)
+    true_disc = generate_true_disc(n_sub, min_disc = min_disc, max_disc = max_disc, distribution = distribution, random_state = rng)
+    budgets = np.asarray(budgets, dtype = np.int64)
+    
+    n_first = (budgets*first_stage_fraction).astype(np.int64)//n_sub
+    n_second = (budgets - n_first*n_sub)//max(n_near, 1)
+    n_uniform = budgets//n_sub
+    
+    output = {'budgets': budgets, 'two_stage_budgets': n_first*n_sub + n_second*n_near, 'uniform_budgets': n_uniform*n_sub, 
+              'two_stage_frac_caught': np.zeros([n_simulations, len(budgets)]), 'uniform_frac_caught': np.zeros([n_simulations, len(budgets)])}
+    
+    for i in range(len(budgets)):
+        output['two_stage_frac_caught'][:, i] = simulate_frac_caught_two_stage(true_disc, n_first[i], n_second[i], n_punish, n_near, n_simulations, rng, 
+                                                                               max_block_elements = max_block_elements)
+        output['uniform_frac_caught'][:, i] = simulate_frac_caught(true_disc, n_uniform[i], n_punish, n_simulations, rng, 
+                                                                   max_block_elements = max_block_elements)
+    
+    for design in ['two_stage', 'uniform']:
+        output[design + '_mean'] = np.mean(output[design + '_frac_caught'], axis = 0)
+        if n_guarantee is not None:
+            output[design + '_freq'] = np.mean(output[design + '_frac_caught'] >= n_guarantee/n_punish, axis = 0)
+    
+    return output
+
+def simulate_frac_caught_allocation(true_disc, n_samples, n_punish, n_simulations, rng, max_block_elements = MAX_BLOCK_ELEMENTS):
+    """ Version of simulate_frac_caught() with a number of samples per subordinate: n_samples is a 1Xn_sub array (or a number for all subordinates).
+        Subordinates are ranked by measured discrepancy (mismatch count / number of samples; 0 for subordinates without samples).
+    """
+    
+    n_sub = len(true_disc)
+    n_samples = np.broadcast_to(np.asarray(n_samples, dtype = np.int64), [n_sub])
+    is_true_worst = get_worst_offenders_mask(true_disc, n_punish)
+    
+    block_size = max(max_block_elements // max(n_sub, 1), 1)
+    frac_caught = np.zeros(n_simulations)
+    
+    for start in range(0, n_simulations, block_size):
+        stop = min(start + block_size, n_simulations)
+        meas_counts = rng.binomial(n_samples, true_disc, size = [stop - start, n_sub])
+        meas_disc = meas_counts/np.maximum(n_samples, 1)
+        meas_worst = get_worst_offenders_batch(meas_disc, n_punish)
+        frac_caught[start:stop] = np.sum(is_true_worst[meas_worst], axis = 1)/n_punish
+        
+    return frac_caught
+
+def simulate_frac_caught_two_stage(true_disc, n_first, n_second, n_punish, n_near, n_simulations, rng, max_block_elements = MAX_BLOCK_ELEMENTS):
+    """ Simulate a two-stage design and return the fraction of the n_punish worst offenders caught in each of n_simulations simulations.
+        First stage: n_first samples from every subordinate. Second stage: n_second more samples from each of the n_near subordinates whose first-stage 
+        measured rank is closest to the n_punish cut (ranks n_punish - n_near//2 to n_punish + n_near - n_near//2 - 1, shifted to lie in [0, n_sub)). 
+        Subordinates are then ranked by measured discrepancy over all their samples.
+    """
+    
+    n_sub = len(true_disc)
+    is_true_worst = get_worst_offenders_mask(true_disc, n_punish)
+    first_near_rank = min(max(n_punish - n_near//2, 0), n_sub - n_near)
+    
+    block_size = max(max_block_elements // max(n_sub, 1), 1)
+    frac_caught = np.zeros(n_simulations)
+    
+    for start in range(0, n_simulations, block_size):
+        stop = min(start + block_size, n_simulations)
+        meas_counts = rng.binomial(n_first, true_disc, size = [stop - start, n_sub])
+        
+        meas_order = np.argsort(-meas_counts, axis = 1, kind = 'stable')
+        near = meas_order[:, first_near_rank:first_near_rank + n_near]
+        extra_counts = rng.binomial(n_second, true_disc[near])
+        np.put_along_axis(meas_counts, near, np.take_along_axis(meas_counts, near, axis = 1) + extra_counts, axis = 1)
+        n_samples = np.full([stop - start, n_sub], n_first, dtype = np.int64)
+        np.put_along_axis(n_samples, near, n_first + n_second, axis = 1)
+        
+        meas_worst = get_worst_offenders_batch(meas_counts/np.maximum(n_samples, 1), n_punish)
+        frac_caught[start:stop] = np.sum(is_true_worst[meas_worst], axis = 1)/n_punish
+        
+    return frac_caught
+
+def analytic_catch_probability(n_sub, n_samples, n_punish, n_guarantee = None, min_disc = 0, max_disc = 1, distribution = 'uniform', noise = 'binomial', 
+                               n_nodes = 64, n_grid = 4001):
+    """ Approximate, without simulation, the probability that each of the n_punish worst offenders is caught, and the frequency with which n_guarantee 
+        of them are caught, from order statistics of the true and measured discrepancies.
+        The j-th worst offender is given the expected j-th largest of n_sub true discrepancies; the other n_sub - n_punish subordinates have true 
+        discrepancies distributed below the expected cut. The measured cut (the n_punish-th largest measured discrepancy) is replaced by the value x 
+        above which n_punish subordinates are measured on average, integrating measurement noise over the true discrepancies of the non-offenders. 
+        Given the cut, offenders are caught independently, with probability P(measured > x) (ties at x share the remaining places), so the number caught 
+        has a Poisson binomial distribution. The approximation improves with n_sub; compare with Monte Carlo simulations (compare_analytic_monte_carlo()) 
+        before relying on it in a new regime.
+        
+        Inputs:
+        n_sub, n_samples, n_punish, n_guarantee, min_disc, max_disc, distribution: as in binary_search(). Only distribution = 'uniform' is supported
+        noise: default 'binomial', one of NOISE_MODELS. 'binomial' sums exactly over mismatch counts, 'normal' integrates a normal approximation
+        n_nodes: default 64, number of Gauss-Legendre nodes for integrating over the true discrepancies of non-offenders ('normal' noise)
+        n_grid: default 4001, number of measured values at which the cut is searched ('normal' noise)
+        
+        Outputs:
+        output: dict with 
+            'true_disc': 1Xn_punish array, true discrepancies assumed for the worst offenders, from worst
+            'p_caught': 1Xn_punish array, probability that each worst offender is caught
+            'mean_frac_caught': expected fraction of worst offenders caught
+            'freq': if n_guarantee is given, approximate probability that at least n_guarantee worst offenders are caught
+    """
+    
+    if distribution != 'uniform':
+        raise ValueError('Only the uniform distribution of true discrepancy scores is supported')
+    if not 0 < n_punish < n_sub:
+        raise ValueError('n_punish should be larger than 0 and smaller than n_sub')
+    if noise not in NOISE_MODELS:
+        raise ValueError('noise should be one of {0}'.format(NOISE_MODELS))
+    
+    # Expected values of the n_punish largest order statistics of n_sub uniform draws, and the expected true cut below them
+    true_disc = max_disc - (max_disc - min_disc)*np.arange(1, n_punish + 1)/(n_sub + 1)
+    true_cut = max_disc - (max_disc - min_disc)*n_punish/n_sub
+    n_others = n_sub - n_punish
+    
+    if noise == 'binomial':
+        counts = np.arange(n_samples + 1)
+        # Probability that a non-offender has each mismatch count, integrated exactly over its uniform true discrepancy
+        pmf_others = (beta.cdf(true_cut, counts + 1, n_samples - counts + 1) - beta.cdf(min_disc, counts + 1, n_samples - counts + 1))/((n_samples + 1)*(true_cut - min_disc))
+        sf_others = np.cumsum(pmf_others[::-1])[::-1] - pmf_others
+        sf = binom.sf(counts[None, :], n_samples, true_disc[:, None])
+        pmf = binom.pmf(counts[None, :], n_samples, true_disc[:, None])
+        
+        # Cut: the smallest count with fewer than n_punish subordinates expected strictly above it; ties at the cut share the remaining places
+        n_above = np.sum(sf, axis = 0) + n_others*sf_others
+        n_at = np.sum(pmf, axis = 0) + n_others*pmf_others
+        cut = np.nonzero(n_above < n_punish)[0][0]
+        p_caught = sf[:, cut] + min((n_punish - n_above[cut])/n_at[cut], 1)*pmf[:, cut]
+    else:
+        nodes, weights = np.polynomial.legendre.leggauss(n_nodes)
+        other_disc = min_disc + (true_cut - min_disc)*(nodes + 1)/2
+        x = np.linspace(min_disc - 3/np.sqrt(n_samples), max_disc + 3/np.sqrt(n_samples), n_grid)
+        sf_others = np.sum(weights[None, :]*norm.sf(x[:, None], other_disc[None, :], get_meas_sd(other_disc, n_samples)[None, :]), axis = 1)/2
+        sf = norm.sf(x[None, :], true_disc[:, None], get_meas_sd(true_disc, n_samples)[:, None])
+        
+        # Cut: interpolated between the grid values around which n_punish subordinates are expected above
+        n_above = np.sum(sf, axis = 0) + n_others*sf_others
+        cut = max(np.nonzero(n_above < n_punish)[0][0], 1)
+        weight = (n_above[cut - 1] - n_punish)/(n_above[cut - 1] - n_above[cut])
+        p_caught = sf[:, cut - 1]*(1 - weight) + sf[:, cut]*weight
+    
+    p_caught = np.clip(p_caught, 0, 1)
+    output = {'true_disc': true_disc, 'p_caught': p_caught, 'mean_frac_caught': np.mean(p_caught)}
+    
+    if n_guarantee is not None:
+        # Poisson binomial distribution of the number caught
+        p_n_caught = np.zeros(n_punish + 1)
+        p_n_caught[0] = 1
+        for p in p_caught:
+            p_n_caught[1:] = p_n_caught[1:]*(1 - p) + p_n_caught[:-1]*p
+            p_n_caught[0] = p_n_caught[0]*(1 - p)
+        output['freq'] = np.sum(p_n_caught[n_guarantee:])
+    
+    return output
+
+def get_meas_sd(true_disc, n_samples):
+    """ Standard deviation of the measured discrepancy of subordinates with true discrepancies true_disc from n_samples samples, with a small floor so 
+        that the normal approximation stays defined at true discrepancies of 0 and 1.
+    """
+    
+    return np.maximum(np.sqrt(true_disc*(1 - true_disc)/n_samples), 1e-3/np.sqrt(n_samples))
+
+def compare_analytic_monte_carlo(n_sub, n_samples_values, n_punish, n_guarantee, n_simulations = 1000, n_true_draws = 10, min_disc = 0, max_disc = 1, 
+                                 distribution = 'uniform', noise = 'binomial', random_state = None):
+    """ Compare analytic_catch_probability() with Monte Carlo simulations (batch_sample_size_simulation()) at each number of samples in n_samples_values, 
+        for validating the approximation. The approximation averages over true discrepancies, so the simulations are split over n_true_draws draws of 
+        true discrepancies.
+        
+        Inputs:
+        n_sub, n_punish, n_guarantee, min_disc, max_disc, distribution: as in binary_search()
+        n_samples_values: list of numbers of samples per subordinate
+        n_simulations: default 1000, number of simulations per number of samples
+        n_true_draws: default 10, number of draws of true discrepancies the simulations are split over
+        noise: default 'binomial', noise model of analytic_catch_probability()
+        random_state: optional, np.random.Generator or seed for the simulations
+        
+        Outputs:
+        report: dict with 'n_samples_values', and for each number of samples (1Xlen(n_samples_values) arrays)
+            'analytic_mean', 'monte_carlo_mean': expected / simulated mean fraction of worst offenders caught
+            'analytic_freq', 'monte_carlo_freq': approximate / simulated frequency of catching n_guarantee worst offenders
+            'monte_carlo_freq_low', 'monte_carlo_freq_high': 95% Wilson interval on the simulated frequency
+            'analytic_time', 'monte_carlo_time': run times in seconds
+    """
+    
+    rng = np.random.default_rng(random_state)
+    keys = ['analytic_mean', 'monte_carlo_mean', 'analytic_freq', 'monte_carlo_freq', 'monte_carlo_freq_low', 'monte_carlo_freq_high', 'analytic_time', 
+            'monte_carlo_time']
+    report = {key: np.zeros(len(n_samples_values)) for key in keys}
+    report['n_samples_values'] = np.asarray(n_samples_values)
+    sizes = [len(chunk) for chunk in np.array_split(np.arange(n_simulations), n_true_draws)]
+    
+    for i, n_samples in enumerate(n_samples_values):
+        start = time.perf_counter()
+        analytic = analytic_catch_probability(n_sub, n_samples, n_punish, n_guarantee = n_guarantee, min_disc = min_disc, max_disc = max_disc, 
+                                              distribution = distribution, noise = noise)
+        report['analytic_time'][i] = time.perf_counter() - start
+        report['analytic_mean'][i] = analytic['mean_frac_caught']
+        report['analytic_freq'][i] = analytic['freq']
+        
+        start = time.perf_counter()
+        frac_caught = np.concatenate([batch_sample_size_simulation(n_sub, n_samples, n_punish, n_simulations = size, min_disc = min_disc, max_disc = max_disc, 
+                                                                   distribution = distribution, random_state = rng) for size in sizes])
+        report['monte_carlo_time'][i] = time.perf_counter() - start
+        report['monte_carlo_mean'][i] = np.mean(frac_caught)
+        n_caught = np.sum(frac_caught >= n_guarantee/n_punish)
+        report['monte_carlo_freq'][i] = n_caught/n_simulations
+        report['monte_carlo_freq_low'][i], report['monte_carlo_freq_high'][i] = get_freq_interval(n_caught, n_simulations)
+    
+    return report
+
+def memory_budgeted_simulation(n_sub, n_samples, n_punish, n_simulations = 100, memory_limit = 2**30, min_disc = 0, max_disc = 1, distribution = 'uniform', 
+                               random_state = None):
+    """ Memory-budgeted version of batch_sample_size_simulation() for large numbers of subordinates and simulations. True discrepancies are stored as 
+        float32 and mismatch counts in the smallest unsigned integer type that holds n_samples (uint8, uint16, ...). Simulations are run in chunks sized 
+        so that the estimated memory in use stays below memory_limit, and only the fraction caught of each simulation is kept. Instead of int64 
+        argsort/argpartition indices, the measured cut of each simulation is found with np.partition on the counts: offenders above the cut are caught, 
+        and offenders tied at the cut are caught with a hypergeometric draw of the remaining places (random tie-breaking).
+        Assumes random sampling and binary discrepancy (% mismatch between sub and sup).
+        
+        Inputs:
+        n_sub, n_samples, n_punish, n_simulations, min_disc, max_disc, distribution: as in single_sample_size_simulation()
+        memory_limit: default 2**30, memory in bytes available to the simulation
+        random_state: optional, np.random.Generator or seed for true and measured discrepancies
+        
+        Outputs:
+        output: dict with 
+            'frac_caught': 1Xn_simulations array of fraction of worst offenders caught in each simulation
+            'chunk_size': number of simulations per chunk
+            'count_dtype': dtype of mismatch counts
+            'estimated_peak_bytes': estimated largest memory in use
+            'peak_bytes': largest memory allocated during the simulation, measured with tracemalloc
+    """
+    
+    count_dtype = next(t for t in [np.uint8, np.uint16, np.uint32, np.uint64] if n_samples <= np.iinfo(t).max)
+    item_size = np.dtype(count_dtype).itemsize
+    
+    # Held throughout: true discrepancies (float32), the float64 copy and int64 counts of one binomial draw, the output and numpy's reduction buffers.
+    # Held per simulation of a chunk: the counts and their partitioned copy (or comparison with the cut), the counts of the worst offenders and 
+    # a few per-simulation sums
+    fixed_bytes = n_sub*(4 + 8 + 8) + n_simulations*8 + 2**17
+    row_bytes = 2*item_size*n_sub + (item_size + 1)*n_punish + 64
+    chunk_size = min((memory_limit - fixed_bytes)//row_bytes, max(n_simulations, 1))
+    if chunk_size < 1:
+        raise ValueError('memory_limit should be at least {0} bytes for {1} subordinates'.format(fixed_bytes + row_bytes, n_sub))
+    
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    start_bytes = tracemalloc.get_traced_memory()[0]
+    
+    try:
+        rng = np.random.default_rng(random_state)
+        true_disc = generate_true_disc(n_sub, min_disc = min_disc, max_disc = max_disc, distribution = distribution, random_state = rng).astype(np.float32)
+        true_worst = np.argpartition(true_disc, n_sub - n_punish)[n_sub - n_punish:]
+        frac_caught = np.zeros(n_simulations)
+        
+        for start in range(0, n_simulations, chunk_size):
+            stop = min(start + chunk_size, n_simulations)
+            meas_counts = np.empty([stop - start, n_sub], dtype = count_dtype)
+            for row in range(stop - start):
+                meas_counts[row] = rng.binomial(n_samples, true_disc)
+            
+            # Fancy indexing copies the cut, so that the partitioned counts are freed
+            cut = np.partition(meas_counts, n_sub - n_punish, axis = 1)[:, [n_sub - n_punish]]
+            # np.sum rather than np.count_nonzero(axis = 1), which copies the boolean array
+            n_above = np.sum(meas_counts > cut, axis = 1)
+            n_tied = np.sum(meas_counts == cut, axis = 1)
+            caught_above = np.sum(meas_counts[:, true_worst] > cut, axis = 1)
+            caught_tied = np.sum(meas_counts[:, true_worst] == cut, axis = 1)
+            del meas_counts
+            
+            caught = caught_above + rng.hypergeometric(caught_tied, n_tied - caught_tied, n_punish - n_above)
+            frac_caught[start:stop] = caught/n_punish
+        
+        peak_bytes = tracemalloc.get_traced_memory()[1] - start_bytes
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+    
+    output = {'frac_caught': frac_caught, 'chunk_size': chunk_size, 'count_dtype': np.dtype(count_dtype), 
+              'estimated_peak_bytes': fixed_bytes + row_bytes*chunk_size, 'peak_bytes': peak_bytes}
+    
+    return output
+
+def sample_size_sweep_simulation(n_sub, n_samples_values, n_punish, n_guarantee, confidence = 0.9, n_simulations = 100, min_disc = 0, max_disc = 1, 
+                                 distribution = 'uniform', random_state = None, max_block_elements = MAX_BLOCK_ELEMENTS):
+    """ Alternative to binary_search(): simulate the catch frequency at every sample size in n_samples_values in one incremental pass, with common random 
+        numbers. True discrepancies are drawn once, and in each simulation the measurement at a larger sample size extends the measurement at the previous 
+        one: the mismatch count at n + delta is the count at n plus a binomial draw of the delta new samples. The catch-probability curve is therefore 
+        far less noisy across n than independent simulations, and costs one binomial draw per step instead of a full simulation per probe.
+        Assumes random sampling and binary discrepancy (% mismatch between sub and sup).
+        
+        Inputs:
+        n_sub, n_punish, n_guarantee, confidence, n_simulations, min_disc, max_disc, distribution: as in binary_search()
+        n_samples_values: increasing list of numbers of samples per subordinate to evaluate
+        random_state: optional, np.random.Generator or seed for true and measured discrepancies
+        max_block_elements: default MAX_BLOCK_ELEMENTS, largest number of (simulation x subordinate) measurements held in memory at once
+        
+        Outputs:
+        output: dict with 
+            'n_samples_values': array of sample sizes evaluated
+            'frac_caught': n_simulations X len(n_samples_values) array of fraction of worst offenders caught
+            'freq': 1Xlen(n_samples_values) array, frequency with which n_guarantee worst offenders are caught at each sample size
+            'n_samples': least sample size from which freq is larger than confidence for all larger sample sizes evaluated, or None
+            'message'
+    """
+    
+    n_samples_values = np.asarray(n_samples_values, dtype = np.int64)
+    if len(n_samples_values) == 0 or n_samples_values[0] < 0 or np.any(np.diff(n_samples_values) <= 0):
+        raise ValueError('n_samples_values should be a non-empty increasing list of non-negative sample sizes')
+    
+    rng = np.random.default_rng(random_state)
+    true_disc = generate_true_disc(n_sub, min_disc = min_disc, max_disc = max_disc, distribution = distribution, random_state = rng)
+    is_true_worst = get_worst_offenders_mask(true_disc, n_punish)
+    n_steps = np.diff(n_samples_values, prepend = 0)
+    
+    block_size = max(max_block_elements // max(n_sub, 1), 1)
+    frac_caught = np.zeros([n_simulations, len(n_samples_values)])
+    
+    for start in range(0, n_simulations, block_size):
+        stop = min(start + block_size, n_simulations)
+        meas_counts = np.zeros([stop - start, n_sub], dtype = np.int64)
+        for i, n_step in enumerate(n_steps):
+            meas_counts += rng.binomial(n_step, true_disc, size = [stop - start, n_sub])
+            meas_worst = get_worst_offenders_batch(meas_counts, n_punish)
+            frac_caught[start:stop, i] = np.sum(is_true_worst[meas_worst], axis = 1)/n_punish
+    
+    freq = np.mean(frac_caught >= n_guarantee/n_punish, axis = 0)
+    output = {'n_samples_values': n_samples_values, 'frac_caught': frac_caught, 'freq': freq}
+    
+    not_enough = np.nonzero(~(freq > confidence))[0]
+    if len(not_enough) == 0:
+        output['n_samples'] = n_samples_values[0]
+        output['message'] = 'Smallest sample size evaluated is enough, decrease minimum # samples'
+    elif not_enough[-1] == len(n_samples_values) - 1:
+        output['n_samples'] = None
+        output['message'] = 'Increase maximum # samples'
+    else:
+        output['n_samples'] = n_samples_values[not_enough[-1] + 1]
+        output['message'] = '{0} samples per subordinate catch {1} of the {2} worst offenders with frequency {3:.3f}'.format(output['n_samples'], n_guarantee, 
+                                                                                                                         n_punish, freq[not_enough[-1] + 1])
+    
+    return output
+
+def n_punish_sweep_simulation(n_sub, n_samples, n_punish_values, n_simulations = 100, min_disc = 0, max_disc = 1, distribution = 'uniform', random_state = None, 
+                              max_block_elements = MAX_BLOCK_ELEMENTS):
+    """ Simulate discrepancy score measurements for a number of subordinates and report the fraction of worst offenders caught for every number of 
+        subordinates punished in n_punish_values, from a single ranking of true and measured discrepancies per simulation (see get_overlap_curve()).
+        Assumes random sampling and binary discrepancy (% mismatch between sub and sup).
+        
+        Inputs:
+        n_sub, n_samples, n_simulations, min_disc, max_disc, distribution: as in single_sample_size_simulation()
+        n_punish_values: list of numbers of subordinates to punish (# worst offenders), each between 1 and n_sub
+        random_state: optional, np.random.Generator or seed for true and measured discrepancies
+        max_block_elements: default MAX_BLOCK_ELEMENTS, largest number of (simulation x subordinate) measurements held in memory at once
+        
+        Outputs:
+        frac_caught: n_simulations X len(n_punish_values) array, frac_caught[sim, i] is the fraction of the n_punish_values[i] worst offenders caught in simulation sim
+    """
+    
+    n_punish_values = np.asarray(n_punish_values)
+    if not np.all((n_punish_values >= 1) & (n_punish_values <= n_sub)):
+        raise ValueError('n_punish_values should all be at least 1 and at most n_sub')
+    
+    rng = np.random.default_rng(random_state)
+    true_disc = generate_true_disc(n_sub, min_disc = min_disc, max_disc = max_disc, distribution = distribution, random_state = rng)
+    true_rank = get_rank(true_disc)
+    
+    block_size = max(max_block_elements // max(n_sub, 1), 1)
+    frac_caught = np.zeros([n_simulations, len(n_punish_values)])
+    
+    for start in range(0, n_simulations, block_size):
+        stop = min(start + block_size, n_simulations)
+        meas_counts = rng.binomial(n_samples, true_disc, size = [stop - start, n_sub])
+        overlap = get_overlap_curve(true_rank, meas_counts)
+        frac_caught[start:stop] = overlap[:, n_punish_values - 1]/n_punish_values
+    
+    return frac_caught
+
+def get_rank(array):
+    """ Return the rank of each element of a 1-D array from the largest (rank 0) to the smallest.
+    """
+    rank = np.zeros(len(array), dtype = np.int64)
+    rank[np.argsort(-array, kind = 'stable')] = np.arange(len(array))
+    
+    return rank
+
+def get_overlap_curve(true_rank, meas_array):
+    """ For every k, count the subordinates that are among the k worst both by true rank and by measured discrepancy, for each row of meas_array.
+        A subordinate at true rank r and measured rank p is counted for all k > max(r, p), so the counts for all k are a cumulative sum of a 
+        histogram of max(r, p), which needs only one sort of each row of meas_array.
+        
+        Inputs:
+        true_rank: 1Xn_sub array, output of get_rank() on true discrepancies
+        meas_array: n_rows X n_sub array of measured discrepancies (or counts)
+        
+        Outputs:
+        overlap: n_rows X n_sub array, overlap[row, k - 1] is the number of the k true worst offenders among the k measured worst offenders of row
+    """
+    n_rows, n_sub = meas_array.shape
+    meas_order = np.argsort(-meas_array, axis = 1, kind = 'stable')
+    last_rank = np.maximum(np.arange(n_sub)[None, :], true_rank[meas_order])
+    histogram = np.bincount((last_rank + n_sub*np.arange(n_rows)[:, None]).ravel(), minlength = n_rows*n_sub)
+    
+    return np.cumsum(np.reshape(histogram, [n_rows, n_sub]), axis = 1)
+
+def generate_true_disc(n_sub, min_disc = 0, max_disc = 1, distribution = 'uniform', random_state = None):
     """ Given a number of subordinates n_sub, simulate discrepancy scores between min_disc (default: 0) and max_disc (default: 1) for each subordinate.
         Discrepancy scores are drawn from a distribution (default: uniform) over [min_disc, max_disc]. Assumes binary discrepancy (% mismatch between sub and sup).
+        random_state: optional, np.random.Generator or seed. If None, numpy's global random state is used
     """
     
     if distribution == 'uniform':
         
-        true_disc = np.random.uniform(min_disc, max_disc, n_sub)
+        if random_state is None:
+            true_disc = np.random.uniform(min_disc, max_disc, n_sub)
+        else:
+            true_disc = np.random.default_rng(random_state).uniform(min_disc, max_disc, n_sub)
     
     return true_disc
 
@@ -144,6 +781,21 @@ def get_worst_offenders(array, n_worst, worse = 'larger'):
         
     return worst
         
+def get_worst_offenders_mask(array, n_worst):
+    """ Return a boolean array, True at the n_worst largest elements of array.
+    """
+    mask = np.zeros(len(array), dtype = bool)
+    mask[np.argpartition(array, len(array) - n_worst)[len(array) - n_worst:]] = True
+    
+    return mask
+
+def get_worst_offenders_batch(array, n_worst):
+    """ Return indices of the n_worst largest elements of each row of a 2-D array (in no particular order), using argpartition instead of a full sort.
+    """
+    n = array.shape[1]
+    
+    return np.argpartition(array, n - n_worst, axis = 1)[:, n - n_worst:]
+        
 def get_fraction_overlap(array1, array2):
     """ Returns the fraction of elements of array1 present in array2. Assumes array1 and array2 have the same number of elements. 
     """
@@ -0,0 +1,40 @@
+"""sample size result cache
+
+Revision ID: 3f9a2c71d0b4
+Revises: e1b5d0a7c93f
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a2c71d0b4'
+down_revision = 'e1b5d0a7c93f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('sample_size_result',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('key', sa.String(length=256), nullable=True),
+    sa.Column('algorithm_version', sa.Integer(), nullable=True),
+    sa.Column('n_min', sa.Integer(), nullable=True),
+    sa.Column('n_stable', sa.Integer(), nullable=True),
+    sa.Column('p_stable', sa.Float(), nullable=True),
+    sa.Column('message', sa.String(length=128), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('sample_size_result', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_sample_size_result_algorithm_version'), ['algorithm_version'], unique=False)
+        batch_op.create_index(batch_op.f('ix_sample_size_result_key'), ['key'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('sample_size_result', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_sample_size_result_key'))
+        batch_op.drop_index(batch_op.f('ix_sample_size_result_algorithm_version'))
+
+    op.drop_table('sample_size_result')
@@ -0,0 +1,177 @@
+from collections import OrderedDict
+from hashlib import sha256
+from threading import Lock
+from sqlalchemy.exc import IntegrityError
+from webapp import webapp, db
+from webapp.models import SampleSizeResult
+from Scripts import binomial_confidence
+
+def sample_size_key(threshold, confidence, accuracy, n_high):
+    '''
+    Return a string identifying the inputs of binomial_confidence.lookup_n_samples_single_threshold(), with floats rounded so that equivalent form 
+    submissions share a key.
+    '''
+
+    return 'exact_single_threshold:t={0:.10g}:c={1:.10g}:a={2:.10g}:n_high={3:d}'.format(threshold, confidence, accuracy, int(n_high))
+
+class SampleSizeCache:
+
+    '''
+    Two-level cache of sample size results: an in-process LRU of at most max_size entries, in front of the SampleSizeResult table shared by all workers.
+    Rows computed by a different binomial_confidence.ALGORITHM_VERSION are ignored and replaced.
+    '''
+
+    def __init__(self, max_size = 1024):
+
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.counts = {'table_hits': 0, 'memory_hits': 0, 'database_hits': 0, 'misses': 0, 'evictions': 0}
+
+    def lookup_n_samples_single_threshold(self, threshold, confidence = 0.9, accuracy = 0.02, table_path = None, n_high = 10000000):
+
+        '''
+        Return the output of binomial_confidence.lookup_n_samples_single_threshold(): from the precomputed table at table_path if the parameters are on 
+        its grid, otherwise from the cache if possible, and by exact computation (searching up to n_high) if not. Every input gets the same n_min and 
+        n_stable either way, when they are at most n_high.
+        '''
+
+        if table_path is not None:
+            output = binomial_confidence.lookup_sample_size_table(table_path, threshold, confidence, accuracy)
+            if output is not None:
+                with self.lock:
+                    self.counts['table_hits'] += 1
+                return output
+
+        key = sample_size_key(threshold, confidence, accuracy, n_high)
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.counts['memory_hits'] += 1
+                return dict(self.entries[key])
+
+        # The database query and the computation run outside the lock, so that other requests are not held up
+        row = SampleSizeResult.query.filter_by(key = key).first()
+        if row is not None and row.algorithm_version == binomial_confidence.ALGORITHM_VERSION:
+            hit = 'database_hits'
+            output = {'message': row.message, 'n_min': row.n_min, 'n_stable': row.n_stable, 'p_stable': row.p_stable, 'source': 'exact'}
+        else:
+            hit = 'misses'
+            output = binomial_confidence.lookup_n_samples_single_threshold(threshold, confidence = confidence, accuracy = accuracy, exact = True, 
+                                                                          n_high = n_high)
+            self.store(key, row, output)
+
+        with self.lock:
+            self.counts[hit] += 1
+            self.entries[key] = output
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last = False)
+                self.counts['evictions'] += 1
+
+        return dict(output)
+
+    def store(self, key, row, output):
+
+        '''
+        Write a freshly computed result to the shared table, replacing a row of an older algorithm version.
+        '''
+
+        if row is None:
+            row = SampleSizeResult(key = key)
+            db.session.add(row)
+        row.algorithm_version = binomial_confidence.ALGORITHM_VERSION
+        row.n_min = output['n_min']
+        row.n_stable = output['n_stable']
+        row.p_stable = output['p_stable']
+        row.message = output['message']
+
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another worker stored the same key first; its result is identical
+            db.session.rollback()
+
+    def invalidate(self):
+
+        '''
+        Clear the in-process cache and delete rows of the shared table computed by other algorithm versions.
+        '''
+
+        with self.lock:
+            self.entries.clear()
+        SampleSizeResult.query.filter(SampleSizeResult.algorithm_version != binomial_confidence.ALGORITHM_VERSION).delete()
+        db.session.commit()
+
+    def stats(self):
+
+        '''
+        Return hit/miss counters of this process, and the number of entries held in memory.
+        '''
+
+        with self.lock:
+            return dict(self.counts, size = len(self.entries), max_size = self.max_size)
+
+sample_size_cache = SampleSizeCache(max_size = webapp.config.get('SAMPLE_SIZE_CACHE_SIZE', 1024))
+
+class ImageCache:
+
+    '''
+    In-process LRU cache of rendered images, keyed by a hash of the plot parameters and bounded by the total size of the images it holds.
+    '''
+
+    def __init__(self, max_bytes = 32*1024*1024):
+
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.counts = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    @staticmethod
+    def key(**params):
+
+        '''
+        Return a content address for plot parameters: the hex SHA-256 digest of their sorted, normalized representation.
+        '''
+
+        normalized = ':'.join(['{0}={1}'.format(name, '{0:.10g}'.format(value) if isinstance(value, float) else value) for name, value in sorted(params.items())])
+        return sha256(normalized.encode()).hexdigest()
+
+    def get(self, key, render):
+
+        '''
+        Return the image stored under key, calling render() to make it (outside the lock) if it is not cached.
+        '''
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.counts['hits'] += 1
+                return self.entries[key]
+            self.counts['misses'] += 1
+
+        image = render()
+
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = image
+                self.n_bytes += len(image)
+            while self.n_bytes > self.max_bytes and len(self.entries) > 1:
+                evicted_key, evicted_image = self.entries.popitem(last = False)
+                self.n_bytes -= len(evicted_image)
+                self.counts['evictions'] += 1
+
+        return image
+
+    def stats(self):
+
+        '''
+        Return hit/miss counters of this process, and the number and total size of images held in memory.
+        '''
+
+        with self.lock:
+            return dict(self.counts, size = len(self.entries), n_bytes = self.n_bytes, max_bytes = self.max_bytes)
+
+image_cache = ImageCache(max_bytes = webapp.config.get('IMAGE_CACHE_BYTES', 32*1024*1024))
@@ -1,6 +1,16 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, BooleanField, SubmitField, DecimalField, FloatField, IntegerField
-from wtforms.validators import DataRequired, NumberRange
+from wtforms.validators import DataRequired, NumberRange, ValidationError
+
+def less_than_one(form, field):
+    # Validator for probabilities that cannot be reached exactly, e.g. confidence
+    if field.data is not None and field.data >= 1:
+        raise ValidationError('{0} must be smaller than 1'.format(field.label.text))
+
+def greater_than_zero(form, field):
+    # Validator for distances that must be positive, e.g. accuracy
+    if field.data is not None and field.data <= 0:
+        raise ValidationError('{0} must be greater than 0'.format(field.label.text))
 
 class LoginForm(FlaskForm):
     username = StringField('Username', validators = [DataRequired()])
@@ -20,22 +30,17 @@ class SampleSizeForm(FlaskForm):
     
     # Optional inputs
     acc_desc = 'Distance from threshold at which confidence guarantee applies.'
-    accuracy = FloatField('Accuracy', default = 0.02, validators = [NumberRange(min = 0, max = 1, message = 'Accuracy must be a decimal value between 0 and 1')], description = acc_desc)
+    accuracy = FloatField('Accuracy', default = 0.02, validators = [NumberRange(min = 0, max = 1, message = 'Accuracy must be a decimal value between 0 and 1'), greater_than_zero], 
+                          description = acc_desc)
     
     conf_desc = 'Desired probability of correctly classifying workers as red band.'
-    confidence = FloatField('Confidence', default = 0.9, validators = [NumberRange(min = 0, max = 1, message = 'Confidence must be a decimal value between 0 and 1')], description = conf_desc)
+    confidence = FloatField('Confidence', default = 0.9, validators = [NumberRange(min = 0, max = 1, message = 'Confidence must be a decimal value between 0 and 1'), less_than_one], 
+                            description = conf_desc)
     
-    tol_desc = 'Distance from desired probability at which binary search of number of samples is stopped.'
-    tolerance = FloatField('Tolerance', default = 0.001, validators = [NumberRange(min = 0, max = 1, message = 'Tolerance must be a decimal value between 0 and 1')], description = tol_desc)
-    
-    n_high_desc = 'Maximum possible number of samples for initializing binary search.'
-    n_high = IntegerField('Maximum # samples', default = 10000, validators = [NumberRange(2, 10000000, message = 'Maximum number of samples should be at least 2')], 
+    n_high_desc = 'Maximum number of samples that can be collected per worker.'
+    n_high = IntegerField('Maximum # samples', default = 10000, validators = [NumberRange(1, 10000000, message = 'Maximum number of samples should be at least 1')], 
                           description = n_high_desc)
     
-    n_low_desc = 'Minimum possible number of samples for initializing binary search.'
-    n_low = IntegerField('Minimum # samples', default = 2, validators = [NumberRange(1, 1000000, message = 'Minimum number of samples should be at least 1')], 
-                         description = n_low_desc)
-    
     generate_plot = BooleanField('Generate plot?', default = True)
     
     submit = SubmitField('Generate number of samples')
\ No newline at end of file
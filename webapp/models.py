@@ -13,3 +13,17 @@ class User(db.Model):
     def __repr__(self):
         return '<User {}>'.format(self.username)
 
+class SampleSizeResult(db.Model):
+    
+    # Shared cache of lookup_n_samples_single_threshold() outputs, so that results are reused across web workers and restarts
+    
+    id = db.Column(db.Integer, primary_key = True)
+    key = db.Column(db.String(256), index = True, unique = True) # Normalized input parameters, see webapp.cache.sample_size_key()
+    algorithm_version = db.Column(db.Integer, index = True) # binomial_confidence.ALGORITHM_VERSION that computed the result
+    n_min = db.Column(db.Integer)
+    n_stable = db.Column(db.Integer)
+    p_stable = db.Column(db.Float)
+    message = db.Column(db.String(128))
+    
+    def __repr__(self):
+        return '<SampleSizeResult {}>'.format(self.key)
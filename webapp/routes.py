@@ -1,8 +1,11 @@
-from flask import render_template, flash, redirect, url_for
+from flask import render_template, flash, redirect, url_for, jsonify, request, abort, Response
 from webapp import webapp
 from webapp.forms import LoginForm, SampleSizeForm
+from webapp.cache import sample_size_cache, image_cache
 from Scripts import binomial_confidence
-from os.path import sep
+import numpy as np
+from os.path import sep, dirname
+from os import makedirs
 
 @webapp.route('/') # Decorator that registeres the function as a callback when a web browser requests the URL /
 @webapp.route('/index') # Decorator that registeres the function as a callback when a web browser requests the URL /index
@@ -47,21 +50,95 @@ def sample_size():
         a = form.accuracy.data
         t = form.threshold.data
         c = form.confidence.data
-        t = form.tolerance.data
         n_high = form.n_high.data
-        n_low = form.n_low.data
         make_plot = form.generate_plot.data
 
         with webapp.app_context():
-            output = binomial_confidence.get_n_samples_single_threshold(t, accuracy = a, confidence = c, tolerance = t, n_high = n_high, n_low = n_low,
-                                                                   make_plot = make_plot, fig_path = 'Plots{0}sample_size'.format(sep))
+            # Exact numbers of samples, from the precomputed table when the parameters are on its grid and computed (and cached) otherwise
+            output = sample_size_cache.lookup_n_samples_single_threshold(t, accuracy = a, confidence = c, table_path = sample_size_table_path(), 
+                                                                         n_high = n_high)
+            n_min = output['n_min'] if output['n_min'] is not None and output['n_min'] <= n_high else None
+            n_stable = output['n_stable'] if output['n_stable'] is not None and output['n_stable'] <= n_high else None
+            message = 'Increase maximum # samples' if output['n_min'] is not None and output['n_min'] > n_high else output['message']
+            plot_params = None
+            if make_plot and n_stable is not None:
+                # The image is rendered when the browser requests it, see sample_size_schematic()
+                plot_params = {'threshold': t, 'accuracy': a, 'confidence': c, 'n_samples': n_stable, 'p_red': round(float(output['p_stable']), 5)}
         return render_template('sample_size.html', title = 'Sample size', form = form, 
-                               n_high = output['n_high'], message = output['message'], fig_path = output['fig_path'])
+                               n_min = n_min, n_stable = n_stable, message = message, plot_params = plot_params)
     
     return render_template('sample_size.html', title = 'Sample size', form = form)
 
-@webapp.route('/sample_size_schematic/<path:image_path>') # Decorator that registers the function as a callback when a web browser requests the URL /sample_size_schematic
-def serve_image(image_path):
-    # Assuming image_path is a valid path to your image file
-    # Set the appropriate content type for your image (e.g., 'image/png')
-    return send_file(image_path, mimetype='image/png')
\ No newline at end of file
+def sample_size_table_path():
+    # Path (without extension) of the precomputed sample size table, see binomial_confidence.build_sample_size_table()
+    return webapp.config.get('SAMPLE_SIZE_TABLE', 'Tables{0}sample_size_single_threshold'.format(sep))
+
+IMAGE_MIMETYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+@webapp.route('/sample_size_schematic') # Decorator that registers the function as a callback when a web browser requests the URL /sample_size_schematic
+def sample_size_schematic():
+    # Render the sample size schematic in memory, once per distinct set of parameters, and serve it with an ETag so that browsers can revalidate it
+    try:
+        params = {'threshold': float(request.args['threshold']), 'accuracy': float(request.args['accuracy']), 'confidence': float(request.args['confidence']),
+                  'n_samples': int(request.args['n_samples']), 'p_red': float(request.args['p_red'])}
+    except (KeyError, ValueError):
+        abort(400)
+    image_format = request.args.get('format', 'png')
+    if image_format not in IMAGE_MIMETYPES:
+        abort(400)
+    
+    key = image_cache.key(image_format = image_format, **params)
+    if key in request.if_none_match:
+        response = Response(status = 304)
+    else:
+        image = image_cache.get(key, lambda: binomial_confidence.render_schematic_single_threshold(params['threshold'], params['accuracy'], params['confidence'], 
+                                                                                                     params['n_samples'], params['p_red'], image_format = image_format))
+        response = Response(image, mimetype = IMAGE_MIMETYPES[image_format])
+    response.set_etag(key)
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+    return response
+
+@webapp.route('/sample_size_curves') # Decorator that registers the function as a callback when a web browser requests the URL /sample_size_curves
+def sample_size_curves():
+    # Classification probability against number of samples, as JSON for plotting in the browser
+    try:
+        t_red = float(request.args['t_red'])
+        t_green = float(request.args['t_green']) if 't_green' in request.args else None
+        accuracy = float(request.args.get('accuracy', 0.02))
+        n_low = int(request.args.get('n_low', 1))
+        n_high = int(request.args.get('n_high', 1000))
+        max_points = int(request.args.get('max_points', 500))
+    except (KeyError, ValueError):
+        abort(400)
+    if not (1 <= n_low <= n_high <= 10000000 and 2 <= max_points <= 10000):
+        abort(400)
+    # Probabilities are only defined for bands inside [0, 1], otherwise classification_curves() returns NaN, which is not valid JSON
+    if not (accuracy > 0 and 0 <= t_red <= 1 and t_red + accuracy <= 1):
+        abort(400)
+    if t_green is not None and not (0 <= t_green <= 1 and 0 <= t_green - accuracy):
+        abort(400)
+    
+    curves = binomial_confidence.classification_curves(t_red = t_red, t_green = t_green, accuracy = accuracy, n_high = n_high, n_low = n_low, 
+                                                       max_points = max_points)
+    return jsonify({'n_samples': curves['n_samples'].tolist(), 
+                    'p_red': np.round(curves['p_red'], 5).tolist(), 
+                    'p_green': None if curves['p_green'] is None else np.round(curves['p_green'], 5).tolist()})
+
+@webapp.route('/sample_size_cache_stats') # Decorator that registers the function as a callback when a web browser requests the URL /sample_size_cache_stats
+def sample_size_cache_stats():
+    # Hit/miss counters of the sample size and image caches in this worker process
+    return jsonify({'sample_size': sample_size_cache.stats(), 'images': image_cache.stats()})
+
+@webapp.cli.command('invalidate-sample-size-cache')
+def invalidate_sample_size_cache():
+    """Delete cached sample size results computed by other versions of binomial_confidence."""
+    sample_size_cache.invalidate()
+
+@webapp.cli.command('build-sample-size-table')
+def build_sample_size_table():
+    """Precompute the sample size table used by /sample_size (may take several minutes)."""
+    path = sample_size_table_path()
+    if dirname(path) != '':
+        makedirs(dirname(path), exist_ok = True)
+    binomial_confidence.build_sample_size_table(path)